@@ -10,9 +10,16 @@ from dotenv import load_dotenv
 
 from configs.load_configs import configs
 from src.checker import check_configs, check_env, check_db, check_upgrade
+from src.db_function.database import database
 from src.db_function.init_db import init_db
+from src.db_function.migrate_db import migrate_db
 from src.db_function.repair_db import auto_repair_mismatched_clients
+from src.notification.cursor_store import cursor_store
+from src.notification.subscription_index import subscription_index
 from src.presence_updater import update_presence
+from src.translation.gemini_queue import gemini_queue
+from src.translation.progressive_edit import ProgressiveEdit
+from src.translation.tweet_translator import get_translator
 from src.log import setup_logger
 
 log = setup_logger(__name__)
@@ -27,6 +34,7 @@ bot = commands.Bot(command_prefix=configs['prefix'], intents=intents)
 async def on_ready():
     if not (os.path.isfile(os.path.join(os.getenv('DATA_PATH'), 'tracked_accounts.db'))):
         await init_db()
+    await migrate_db()
         
     check_upgrade()
     
@@ -103,6 +111,7 @@ async def download_log(ctx: commands.context.Context):
 @bot.command()
 @commands.is_owner()
 async def download_data(ctx: commands.context.Context):
+    await database.checkpoint()
     message = await ctx.send(file=discord.File(os.path.join(os.getenv('DATA_PATH'), 'tracked_accounts.db')))
     await message.delete(delay=15)
 
@@ -111,8 +120,16 @@ async def download_data(ctx: commands.context.Context):
 @commands.is_owner()
 async def upload_data(ctx: commands.context.Context):
     raw = await [attachment for attachment in ctx.message.attachments if attachment.filename[-3:] == '.db'][0].read()
-    with open(os.path.join(os.getenv('DATA_PATH'), 'tracked_accounts.db'), 'wb') as wbf:
-        wbf.write(raw)
+    # the pool stays closed until the new file is in place, so no connection reopens the old one
+    async with database.offline():
+        with open(os.path.join(os.getenv('DATA_PATH'), 'tracked_accounts.db'), 'wb') as wbf:
+            wbf.write(raw)
+    await migrate_db()
+    await subscription_index.load()
+    await cursor_store.load()
+    notification = bot.get_cog('Notification')
+    if notification is not None:
+        await notification.account_tracker.reload_users()
     message = await ctx.send('successfully uploaded data')
     await message.delete(delay=5)
 
@@ -153,10 +170,10 @@ async def on_message(message):
         
         # 檢查頻道是否啟用自動翻譯
         if message.channel.id in auto_translate_channels:
-            # 檢查是否有環境變數設置
-            gemini_api_key = os.getenv('GEMINI_API_KEY')
-            if not gemini_api_key:
-                log.warning("未設定 GEMINI_API_KEY 環境變數，無法進行自動翻譯")
+            # 使用整個程序共用的翻譯器，避免每則訊息都重新建立 Gemini 客戶端與連線
+            translator = get_translator()
+            if translator is None:
+                log.warning("翻譯器未初始化，無法進行自動翻譯")
                 return
             
             # 檢查是否為機器人自己發送的通知或用戶發送的連結
@@ -167,13 +184,7 @@ async def on_message(message):
             
             log.info(f"頻道 {message.channel.id} 在自動翻譯列表中，開始處理...")
             
-            # 動態導入翻譯器以避免循環導入
             try:
-                from src.translation.tweet_translator import TweetTranslator
-                
-                log.info("開始初始化翻譯器...")
-                translator = TweetTranslator(gemini_api_key=gemini_api_key)
-                
                 # 確定翻譯結果的目標頻道
                 target_channel_id = None
                 if translation_mode == 'separate':
@@ -190,13 +201,12 @@ async def on_message(message):
                 else:
                     log.info("翻譯模式設置為回覆模式，將在原頻道回覆")
                 
-                # 處理找到的每個推文URL
-                for tweet_url in tweet_urls:
-                    log.info(f"正在處理推文連結: {tweet_url}")
-                    await auto_translate_tweet(message, tweet_url, translator, target_channel_id)
+                # 同時處理找到的每個推文URL，批次模式下可合併為一次翻譯請求
+                log.info(f"正在處理推文連結: {tweet_urls}")
+                await asyncio.gather(*(auto_translate_tweet(message, tweet_url, translator, target_channel_id) for tweet_url in tweet_urls))
                         
             except Exception as e:
-                log.error(f"自動翻譯功能初始化失敗: {e}")
+                log.error(f"自動翻譯失敗: {e}")
         else:
             log.info(f"頻道 {message.channel.id} 不在自動翻譯列表中，跳過翻譯")
     else:
@@ -211,6 +221,7 @@ async def on_message(message):
 
 async def auto_translate_tweet(message, tweet_url, translator, target_channel_id=None):
     """自動翻譯推文的輔助函數"""
+    progress_message = None
     try:
         log.info(f"開始翻譯推文: {tweet_url}")
         
@@ -227,9 +238,29 @@ async def auto_translate_tweet(message, tweet_url, translator, target_channel_id
             target_channel = message.channel
             is_separate_channel = False
         
+        # 佇列已滿時自動翻譯必定被捨棄，不必送出占位訊息
+        if gemini_queue.is_full():
+            log.info(f"翻譯佇列已滿，略過自動翻譯: {tweet_url}")
+            return
+        
+        # 先送出占位訊息，串流翻譯時隨著段落完成逐步更新
+        progress_embed = discord.Embed(
+            title="翻譯結果",
+            description="⏳ 翻譯中...",
+            color=0x1da0f2
+        )
+        if is_separate_channel:
+            progress_message = await target_channel.send(embed=progress_embed)
+        else:
+            progress_message = await message.reply(embed=progress_embed, mention_author=False)
+        
+        async def show_progress(completed_text):
+            progress_embed.description = f"⏳ 翻譯中...\n\n{completed_text[:4000]}"
+            await progress_message.edit(embed=progress_embed)
+        
         # 在目標頻道顯示正在翻譯的狀態
         async with target_channel.typing():
-            result = await translator.translate_tweet(tweet_url, "繁體中文")
+            result = await translator.translate_tweet(tweet_url, "繁體中文", on_progress=ProgressiveEdit(show_progress))
             
             log.info(f"翻譯結果: success={result['success']}")
             log.info(f"發文者: {result.get('username', 'None')}")
@@ -369,16 +400,21 @@ async def auto_translate_tweet(message, tweet_url, translator, target_channel_id
                     else:
                         embed.set_footer(text="🤖 自動翻譯 | 由 Gemini AI 提供翻譯服務，僅供參考。")
                 
-                # 發送翻譯結果
+                # 以完整的翻譯結果取代占位訊息
+                await progress_message.edit(embed=embed)
                 if is_separate_channel:
-                    await target_channel.send(embed=embed)
                     log.info(f"自動翻譯完成，已發送到翻譯頻道: {target_channel.name}")
                 else:
-                    await message.reply(embed=embed, mention_author=False)
                     log.info("自動翻譯完成，已回覆原消息")
                 
+            elif result.get("skipped"):
+                # 通知爆量時捨棄的自動翻譯只記錄日誌，不在頻道中顯示錯誤
+                await progress_message.delete()
+                log.info(f"翻譯佇列已滿，略過自動翻譯: {tweet_url}")
+                
             else:
                 # 翻譯失敗時的簡單提示
+                await progress_message.delete()
                 if is_separate_channel:
                     await target_channel.send(f"❌ 翻譯推文時發生錯誤：{result.get('error', '未知錯誤')}")
                 else:
@@ -387,6 +423,11 @@ async def auto_translate_tweet(message, tweet_url, translator, target_channel_id
                 
     except Exception as e:
         log.error(f"自動翻譯推文時發生錯誤: {e}")
+        if progress_message is not None:
+            try:
+                await progress_message.delete()
+            except discord.HTTPException:
+                pass
         if target_channel_id:
             target_channel = bot.get_channel(target_channel_id)
             if target_channel:
@@ -7,6 +7,8 @@ from discord.ext import commands
 from core.classes import Cog_Extension
 from configs.load_configs import configs
 from src.log import setup_logger
+from src.translation.gemini_queue import gemini_queue
+from src.translation.translation_cache import translation_cache
 
 log = setup_logger(__name__)
 
@@ -235,6 +237,18 @@ class AutoTranslation(Cog_Extension):
             inline=True
         )
         
+        embed.add_field(
+            name="💾 翻譯快取",
+            value=translation_cache.get_status_summary(),
+            inline=False
+        )
+        
+        embed.add_field(
+            name="⏳ 翻譯佇列",
+            value=gemini_queue.get_status_summary(),
+            inline=False
+        )
+        
         embed.add_field(
             name="📝 使用說明",
             value="• 使用 `/autotranslate add_channel` 添加頻道\n"
@@ -1,6 +1,3 @@
-import os
-
-import aiosqlite
 import discord
 from discord import app_commands
 from discord.ext import commands
@@ -9,7 +6,7 @@ from core.classes import Cog_Extension
 from configs.load_configs import configs
 from src.permission import ADMINISTRATOR
 from src.utils import str_to_bool as stb
-from src.db_function.readonly_db import connect_readonly
+from src.db_function.database import database
 from src.discord_ui.pagination import Pagination
 
 CHECK = '\u2705'
@@ -39,7 +36,7 @@ class ListUsers(Cog_Extension):
 
         server_id = itn.guild_id
 
-        async with connect_readonly(os.path.join(os.getenv('DATA_PATH'), 'tracked_accounts.db')) as db:
+        async with database.reader() as db:
             async with db.execute("""
                 SELECT user.username, channel.id, notification.role_id, notification.enable_type, notification.enable_media_type, user.client_used
                 FROM user
@@ -73,19 +70,15 @@ class ListUsers(Cog_Extension):
 
     @list_users.autocomplete('account')
     async def get_clients(self, itn: discord.Interaction, account: str) -> list[app_commands.Choice[str]]:
-        async with connect_readonly(os.path.join(os.getenv('DATA_PATH'), 'tracked_accounts.db')) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.cursor() as cursor:
-                await cursor.execute('SELECT client_used FROM user WHERE enabled = 1')
-                client_used = list(set([row['client_used'] async for row in cursor]))
+        async with database.reader() as db:
+            async with db.execute('SELECT DISTINCT client_used FROM user WHERE enabled = 1') as cursor:
+                client_used = [row['client_used'] async for row in cursor]
                 return [app_commands.Choice(name=row, value=row) for row in client_used if account.lower() in row.lower()]
 
     @list_users.autocomplete('channel')
     async def get_channel(self, itn: discord.Interaction, input_channel: str) -> list[app_commands.Choice[str]]:
-        async with connect_readonly(os.path.join(os.getenv('DATA_PATH'), 'tracked_accounts.db')) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.cursor() as cursor:
-                await cursor.execute('SELECT id FROM channel WHERE server_id = ?', (str(itn.guild_id),))
+        async with database.reader() as db:
+            async with db.execute('SELECT id FROM channel WHERE server_id = ?', (str(itn.guild_id),)) as cursor:
                 channel_list = [itn.guild.get_channel(int(row['id'])) async for row in cursor]
                 return [app_commands.Choice(name=f'#{channel.name}', value=str(channel.id)) for channel in channel_list if input_channel.lower() in channel.name.lower()]
 
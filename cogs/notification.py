@@ -1,22 +1,26 @@
-import os
-import aiosqlite
 import discord
 from discord import app_commands
 from discord.ext import commands
-from tweety import Twitter
 
 from configs.load_configs import configs
 from core.classes import Cog_Extension
 from src.discord_ui.modal import CustomizeMsgModal
 from src.log import setup_logger
 from src.notification.account_tracker import AccountTracker
+from src.notification.client_pool import client_pool
+from src.notification.cursor_store import cursor_store
+from src.notification.load_balancer import load_balancer
+from src.notification.message_template import message_templates
+from src.notification.og_image import og_image_resolver
+from src.notification.rate_limiter import rate_limiter
+from src.notification.snowflake import current_snowflake
+from src.notification.subscription_index import subscription_index
 from src.permission import ADMINISTRATOR
-from src.db_function.readonly_db import connect_readonly
-from src.utils import get_accounts, get_lock, get_utcnow
+from src.db_function.database import database
+from src.utils import get_accounts, get_utcnow
 from src.presence_updater import update_presence
 
 log = setup_logger(__name__)
-lock = get_lock()
 
 class UnknownChannel:
     def __init__(self, name: str, id: int):
@@ -29,6 +33,16 @@ class Notification(Cog_Extension):
         super().__init__(bot)
         self.account_tracker = AccountTracker(bot)
 
+    async def cog_unload(self):
+        self.account_tracker.stop()
+        await cursor_store.flush()
+        await og_image_resolver.close()
+        rate_limiter.save()
+
+    @commands.Cog.listener()
+    async def on_guild_emojis_update(self, guild: discord.Guild, before, after):
+        message_templates.refresh_guild(guild)
+
     add_group = app_commands.Group(name='add', description='Add something', default_permissions=ADMINISTRATOR)
     remove_group = app_commands.Group(name='remove', description='Remove something', default_permissions=ADMINISTRATOR)
     customize_group = app_commands.Group(name='customize', description='Customize something', default_permissions=ADMINISTRATOR)
@@ -40,7 +54,7 @@ class Notification(Cog_Extension):
         account_used=[app_commands.Choice(name=account_name, value=account_name) for account_name, _ in get_accounts().items()]
     )
     @app_commands.rename(enable_type='type')
-    async def notifier(self, itn: discord.Interaction, username: str, channel: discord.TextChannel, mention: discord.Role = None, enable_type: str = '11', media_type: str = '11', account_used: str = list(get_accounts().keys())[0]):
+    async def notifier(self, itn: discord.Interaction, username: str, channel: discord.TextChannel, mention: discord.Role = None, enable_type: str = '11', media_type: str = '11', account_used: str = None):
         """Add a twitter user to specific channel on your server.
 
         Parameters
@@ -56,93 +70,87 @@ class Notification(Cog_Extension):
         media_type: str
             Whether to enable notifications for All Tweets, Tweets with Media, or Tweets without Media Only.
         account_used: str
-            The account used to deliver notifications.
+            The account used to deliver notifications, defaults to the least-loaded one.
         """
 
         await itn.response.defer(ephemeral=True)
 
-        async with aiosqlite.connect(os.path.join(os.getenv('DATA_PATH'), 'tracked_accounts.db')) as db:
-            await db.execute('PRAGMA synchronous = OFF')
-            await db.execute('PRAGMA count_changes = OFF')
-
-            db.row_factory = aiosqlite.Row
-            async with db.cursor() as cursor:
-                try:
-                    app = Twitter(account_used)
-                    await app.connect()
-                    try:
-                        new_user = await app.get_user_info(username)
-                    except Exception:
-                        await itn.followup.send(f'user {username} not found', ephemeral=True)
-                        return
-
-                    await cursor.execute('SELECT * FROM user WHERE id = ?', (str(new_user.id),))
+        try:
+            # any client can look the user up, the one delivering its notifications is decided below
+            lookup_account = account_used or load_balancer.pick()
+            app = await client_pool.get(lookup_account)
+            try:
+                new_user = await app.get_user_info(username)
+            except Exception:
+                await itn.followup.send(f'user {username} not found', ephemeral=True)
+                return
+
+            async with database.reader() as db:
+                async with db.execute('SELECT * FROM user WHERE id = ?', (str(new_user.id),)) as cursor:
                     match_user = await cursor.fetchone()
 
-                    server_id = str(channel.guild.id)
-                    roleID = str(mention.id) if mention is not None else ''
-                    if match_user is None or match_user['enabled'] == 0:
-                        if match_user is None:
-                            async with lock:
-                                await db.execute('BEGIN')
-                                await cursor.execute('INSERT INTO user (id, username, lastest_tweet, client_used) VALUES (?, ?, ?, ?)', (str(new_user.id), new_user.username, get_utcnow(), account_used))
-                                await cursor.execute('INSERT OR IGNORE INTO channel VALUES (?, ?)', (str(channel.id), server_id))
-                                await cursor.execute('INSERT INTO notification (user_id, channel_id, role_id, enable_type, enable_media_type) VALUES (?, ?, ?, ?, ?)', (str(new_user.id), str(channel.id), roleID, enable_type, media_type))
-                                await db.commit()
-                        else:
-                            is_changed_client = False
-                            if match_user['username'] != new_user.username:
-                                async with lock:
-                                    await db.execute('BEGIN')
-                                    await cursor.execute('UPDATE user SET username = ? WHERE id = ?', (new_user.username, str(new_user.id)))
-                                    await db.commit()
-
-                            if match_user['client_used'] != account_used:
-                                if configs['auto_change_client']:
-                                    if configs['auto_unfollow'] or configs['auto_turn_off_notification']:
-                                        old_client_used = match_user['client_used']
-                                        old_app = Twitter(old_client_used)
-                                        await app.connect()
-                                        target_user = await old_app.get_user_info(username)
-
-                                        if configs['auto_unfollow']:
-                                            status = await old_app.unfollow_user(target_user)
-                                            log.info(f'successfully unfollowed {username} (due to client change)') if status else log.warning(f'unable to unfollow {username}')
-                                        else:
-                                            status = await old_app.disable_user_notification(target_user)
-                                            log.info(f'successfully turned off notification for {username} (due to client change)') if status else log.warning(f'unable to turn off notifications for {username}')
-
-                                    is_changed_client = True
+            # an existing user stays on its client unless another one is asked for, only new users go to the least-loaded one
+            if account_used is None:
+                account_used = match_user['client_used'] if match_user is not None else lookup_account
+            if account_used != lookup_account:
+                app = await client_pool.get(account_used)
+
+            server_id = str(channel.guild.id)
+            roleID = str(mention.id) if mention is not None else ''
+            if match_user is None or match_user['enabled'] == 0:
+                if match_user is None:
+                    async with database.writer() as db:
+                        await db.execute('INSERT INTO user (id, username, lastest_tweet, client_used, lastest_tweet_id) VALUES (?, ?, ?, ?, ?)', (str(new_user.id), new_user.username, get_utcnow(), account_used, current_snowflake()))
+                        await db.execute('INSERT OR IGNORE INTO channel VALUES (?, ?)', (str(channel.id), server_id))
+                        await db.execute('INSERT INTO notification (user_id, channel_id, role_id, enable_type, enable_media_type) VALUES (?, ?, ?, ?, ?)', (str(new_user.id), str(channel.id), roleID, enable_type, media_type))
+                else:
+                    is_changed_client = False
+                    if match_user['username'] != new_user.username:
+                        async with database.writer() as db:
+                            await db.execute('UPDATE user SET username = ? WHERE id = ?', (new_user.username, str(new_user.id)))
+
+                    if match_user['client_used'] != account_used:
+                        if configs['auto_change_client']:
+                            if configs['auto_unfollow'] or configs['auto_turn_off_notification']:
+                                old_client_used = match_user['client_used']
+                                old_app = await client_pool.get(old_client_used)
+                                target_user = await old_app.get_user_info(username)
+
+                                if configs['auto_unfollow']:
+                                    status = await old_app.unfollow_user(target_user)
+                                    log.info(f'successfully unfollowed {username} (due to client change)') if status else log.warning(f'unable to unfollow {username}')
                                 else:
-                                    await itn.followup.send(f'user {username} already exists under {account_used}. No changes due to `auto_change_client` setting', ephemeral=True)
-                                    return
-                            async with lock:
-                                await db.execute('BEGIN')
-                                if is_changed_client:
-                                    await cursor.execute('REPLACE INTO user (client_used) VALUES (?) WHERE id = ?', (account_used, match_user['id']))
-                                await cursor.execute('INSERT OR IGNORE INTO channel VALUES (?, ?)', (str(channel.id), server_id))
-                                await cursor.execute('REPLACE INTO notification (user_id, channel_id, role_id, enable_type, enable_media_type) VALUES (?, ?, ?, ?, ?)', (match_user['id'], str(channel.id), roleID, enable_type, media_type))
-                                await cursor.execute('UPDATE user SET enabled = 1 WHERE id = ?', (match_user['id'],))
-                                await db.commit()
-
-                        await app.follow_user(new_user)
-
-                        status = await app.enable_user_notification(new_user)
-                        if status:
-                            log.info(f'successfully turned on notification for {username}')
+                                    status = await old_app.disable_user_notification(target_user)
+                                    log.info(f'successfully turned off notification for {username} (due to client change)') if status else log.warning(f'unable to turn off notifications for {username}')
+
+                            is_changed_client = True
                         else:
-                            log.warning(f'unable to turn on notifications for {username}')
-                    else:
-                        async with lock:
-                            await db.execute('BEGIN')
-                            await cursor.execute('INSERT OR IGNORE INTO channel VALUES (?, ?)', (str(channel.id), server_id))
-                            await cursor.execute('REPLACE INTO notification (user_id, channel_id, role_id, enable_type, enable_media_type) VALUES (?, ?, ?, ?, ?)', (match_user['id'], str(channel.id), roleID, enable_type, media_type))
-                            await db.commit()
-                except Exception as e:
-                    log.error(f'an error occurred while adding notifier: {e}')
-                    await itn.followup.send(f"failed to add notifier, please try again later.", ephemeral=True)
-                    await db.rollback()
-                    return
+                            await itn.followup.send(f'user {username} already exists under {account_used}. No changes due to `auto_change_client` setting', ephemeral=True)
+                            return
+                    async with database.writer() as db:
+                        if is_changed_client:
+                            await db.execute('UPDATE user SET client_used = ? WHERE id = ?', (account_used, match_user['id']))
+                        await db.execute('INSERT OR IGNORE INTO channel VALUES (?, ?)', (str(channel.id), server_id))
+                        await db.execute('REPLACE INTO notification (user_id, channel_id, role_id, enable_type, enable_media_type) VALUES (?, ?, ?, ?, ?)', (match_user['id'], str(channel.id), roleID, enable_type, media_type))
+                        await db.execute('UPDATE user SET enabled = 1 WHERE id = ?', (match_user['id'],))
+
+                await app.follow_user(new_user)
+
+                status = await app.enable_user_notification(new_user)
+                if status:
+                    log.info(f'successfully turned on notification for {username}')
+                else:
+                    log.warning(f'unable to turn on notifications for {username}')
+            else:
+                async with database.writer() as db:
+                    await db.execute('INSERT OR IGNORE INTO channel VALUES (?, ?)', (str(channel.id), server_id))
+                    await db.execute('REPLACE INTO notification (user_id, channel_id, role_id, enable_type, enable_media_type) VALUES (?, ?, ?, ?, ?)', (match_user['id'], str(channel.id), roleID, enable_type, media_type))
+        except Exception as e:
+            log.error(f'an error occurred while adding notifier: {e}')
+            await itn.followup.send(f"failed to add notifier, please try again later.", ephemeral=True)
+            return
+
+        await subscription_index.refresh_user(str(new_user.id))
 
         if match_user is None or match_user['enabled'] == 0:
             await self.account_tracker.addTask(new_user.username, account_used)
@@ -168,58 +176,49 @@ class Notification(Cog_Extension):
         if channel is None: channel = UnknownChannel('unknown', int(channel_id))
         await itn.response.defer(ephemeral=True)
 
-        async with aiosqlite.connect(os.path.join(os.getenv('DATA_PATH'), 'tracked_accounts.db')) as db:
-            await db.execute('PRAGMA synchronous = OFF')
-            await db.execute('PRAGMA count_changes = OFF')
-            
-            db.row_factory = aiosqlite.Row
-            async with db.cursor() as cursor:
-                try:
-                    await cursor.execute('SELECT id FROM channel WHERE server_id = ?', (str(itn.guild_id),))
-                    rows = await cursor.fetchall()
-                    vaild_ids = [row['id'] for row in rows]
-                    if str(channel.id) not in vaild_ids:
-                        raise ValueError(f'can\'t find channel {channel.mention} in {str(itn.guild.name)}!')
-                    
-                    await cursor.execute('SELECT user_id FROM notification, user WHERE username = ? COLLATE NOCASE AND channel_id = ? AND user_id = id AND notification.enabled = 1', (username, str(channel.id)))
+        try:
+            async with database.reader() as db:
+                async with db.execute('SELECT id FROM channel WHERE server_id = ?', (str(itn.guild_id),)) as cursor:
+                    vaild_ids = [row['id'] async for row in cursor]
+                if str(channel.id) not in vaild_ids:
+                    raise ValueError(f'can\'t find channel {channel.mention} in {str(itn.guild.name)}!')
+                
+                async with db.execute('SELECT user_id FROM notification, user WHERE username = ? COLLATE NOCASE AND channel_id = ? AND user_id = id AND notification.enabled = 1', (username, str(channel.id))) as cursor:
                     match_notifier = await cursor.fetchone()
-                    if match_notifier is not None:
-                        async with lock:
-                            await db.execute('BEGIN')
-                            await cursor.execute('UPDATE notification SET enabled = 0 WHERE user_id = ? AND channel_id = ?', (match_notifier['user_id'], str(channel.id)))
-                            await itn.followup.send(f'successfully remove notifier of {username}!', ephemeral=True)
-                            await cursor.execute('SELECT user_id FROM notification WHERE user_id = ? AND enabled = 1', (match_notifier['user_id'],))
-
-                            active_notifiers = await cursor.fetchall()
-                            if not active_notifiers:
-                                await cursor.execute('UPDATE user SET enabled = 0 WHERE id = ?', (match_notifier['user_id'],))
-                            await db.commit()
-                            
-                        if not active_notifiers:
-                            await self.account_tracker.removeTask(username)
-                            
-                            if configs['auto_unfollow'] or configs['auto_turn_off_notification']:
-                                await cursor.execute('SELECT client_used FROM user WHERE id = ?', (match_notifier['user_id'],))
+            if match_notifier is not None:
+                async with database.writer() as db:
+                    await db.execute('UPDATE notification SET enabled = 0 WHERE user_id = ? AND channel_id = ?', (match_notifier['user_id'], str(channel.id)))
+                    async with db.execute('SELECT user_id FROM notification WHERE user_id = ? AND enabled = 1', (match_notifier['user_id'],)) as cursor:
+                        active_notifiers = await cursor.fetchall()
+                    if not active_notifiers:
+                        await db.execute('UPDATE user SET enabled = 0 WHERE id = ?', (match_notifier['user_id'],))
+                await subscription_index.refresh_user(match_notifier['user_id'])
+                await itn.followup.send(f'successfully remove notifier of {username}!', ephemeral=True)
+                    
+                if not active_notifiers:
+                    await self.account_tracker.removeTask(username)
+                    
+                    if configs['auto_unfollow'] or configs['auto_turn_off_notification']:
+                        async with database.reader() as db:
+                            async with db.execute('SELECT client_used FROM user WHERE id = ?', (match_notifier['user_id'],)) as cursor:
                                 result = await cursor.fetchone()
-                                client_used = result['client_used']
-                                app = Twitter(client_used)
-                                await app.connect()
-                                target_user = await app.get_user_info(username)
+                        client_used = result['client_used']
+                        app = await client_pool.get(client_used)
+                        target_user = await app.get_user_info(username)
 
-                                if configs['auto_unfollow']:
-                                    status = await app.unfollow_user(target_user)
-                                    log.info(f'successfully unfollowed {username}') if status else log.warning(f'unable to unfollow {username}')
-                                else:
-                                    status = await app.disable_user_notification(target_user)
-                                    log.info(f'successfully turned off notification for {username}') if status else log.warning(f'unable to turn off notifications for {username}')
-                                    
-                            await update_presence(self.bot)
-                    else:
-                        await itn.followup.send(f'can\'t find notifier {username} in {channel.mention}!', ephemeral=True)
-                except Exception as e:
-                    log.error(f'an error occurred while removing notifier: {e}')
-                    await itn.followup.send(f"failed to remove notifier, please try again later.", ephemeral=True)
-                    await db.rollback()
+                        if configs['auto_unfollow']:
+                            status = await app.unfollow_user(target_user)
+                            log.info(f'successfully unfollowed {username}') if status else log.warning(f'unable to unfollow {username}')
+                        else:
+                            status = await app.disable_user_notification(target_user)
+                            log.info(f'successfully turned off notification for {username}') if status else log.warning(f'unable to turn off notifications for {username}')
+                            
+                    await update_presence(self.bot)
+            else:
+                await itn.followup.send(f'can\'t find notifier {username} in {channel.mention}!', ephemeral=True)
+        except Exception as e:
+            log.error(f'an error occurred while removing notifier: {e}')
+            await itn.followup.send(f"failed to remove notifier, please try again later.", ephemeral=True)
 
     @customize_group.command(name='message')
     @app_commands.rename(channel_id='channel')
@@ -238,27 +237,21 @@ class Notification(Cog_Extension):
         channel = itn.guild.get_channel(int(channel_id))
         if channel is None: channel = UnknownChannel('unknown', int(channel_id))
         
-        async with aiosqlite.connect(os.path.join(os.getenv('DATA_PATH'), 'tracked_accounts.db')) as db:
-            await db.execute('PRAGMA synchronous = OFF')
-            await db.execute('PRAGMA count_changes = OFF')
-
-            db.row_factory = aiosqlite.Row
-            async with db.cursor() as cursor:
-
-                await cursor.execute('SELECT user_id FROM notification, user WHERE username = ? COLLATE NOCASE AND channel_id = ? AND user_id = id AND notification.enabled = 1', (username, str(channel.id)))
+        async with database.reader() as db:
+            async with db.execute('SELECT user_id FROM notification, user WHERE username = ? COLLATE NOCASE AND channel_id = ? AND user_id = id AND notification.enabled = 1', (username, str(channel.id))) as cursor:
                 match_notifier = await cursor.fetchone()
-                if match_notifier is not None:
-                    if default:
-                        await itn.response.defer(ephemeral=True)
-                        async with lock:
-                            await cursor.execute('UPDATE notification SET customized_msg = ? WHERE user_id = ? AND channel_id = ?', (None, match_notifier['user_id'], str(channel.id)))
-                            await db.commit()
-                        await itn.followup.send('successfully restored to default settings', ephemeral=True)
-                    else:
-                        modal = CustomizeMsgModal(match_notifier['user_id'], username, channel)
-                        await itn.response.send_modal(modal)
-                else:
-                    await itn.response.send_message(f'can\'t find notifier {username} in {channel.mention}!', ephemeral=True)
+        if match_notifier is not None:
+            if default:
+                await itn.response.defer(ephemeral=True)
+                async with database.writer() as db:
+                    await db.execute('UPDATE notification SET customized_msg = ? WHERE user_id = ? AND channel_id = ?', (None, match_notifier['user_id'], str(channel.id)))
+                await subscription_index.refresh_user(match_notifier['user_id'])
+                await itn.followup.send('successfully restored to default settings', ephemeral=True)
+            else:
+                modal = CustomizeMsgModal(match_notifier['user_id'], username, channel)
+                await itn.response.send_modal(modal)
+        else:
+            await itn.response.send_message(f'can\'t find notifier {username} in {channel.mention}!', ephemeral=True)
                     
     @r_notifier.autocomplete('channel_id')
     async def get_channels_for_r_notifier(self, itn: discord.Interaction, input_channel: str) -> list[app_commands.Choice[str]]:        
@@ -269,11 +262,9 @@ class Notification(Cog_Extension):
         return await self._fetch_tracked_channels(itn, input_channel, include_unknown=False)
                 
     async def _fetch_tracked_channels(self, itn: discord.Integration, input_channel: str, include_unknown: bool):
-        async with connect_readonly(os.path.join(os.getenv('DATA_PATH'), 'tracked_accounts.db')) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.cursor() as cursor:
-                # Don't show channels that no longer have any notifiers
-                await cursor.execute('''
+        async with database.reader() as db:
+            # Don't show channels that no longer have any notifiers
+            async with db.execute('''
                     SELECT c.id
                     FROM channel AS c
                     WHERE c.server_id = ?
@@ -283,7 +274,7 @@ class Notification(Cog_Extension):
                         WHERE n.channel_id = c.id
                         AND n.enabled = 1
                     )
-                ''', (str(itn.guild_id),))
+                ''', (str(itn.guild_id),)) as cursor:
                 result = []
                 async for row in cursor:
                     channel = itn.guild.get_channel(int(row['id']))
@@ -300,10 +291,8 @@ class Notification(Cog_Extension):
         if selected_channel_id is None:
             return []
 
-        async with connect_readonly(os.path.join(os.getenv('DATA_PATH'), 'tracked_accounts.db')) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.cursor() as cursor:
-                await cursor.execute('SELECT user.username FROM user JOIN notification ON user.id = notification.user_id WHERE notification.channel_id = ? AND notification.enabled = 1', (selected_channel_id,))
+        async with database.reader() as db:
+            async with db.execute('SELECT user.username FROM user JOIN notification ON user.id = notification.user_id WHERE notification.channel_id = ? AND notification.enabled = 1', (selected_channel_id,)) as cursor:
                 users = [row['username'] async for row in cursor]
                 return [app_commands.Choice(name=row, value=row) for row in users if username.lower() in row.lower()]
 
@@ -35,11 +35,14 @@ class RateLimitCommands(commands.Cog):
                 value=(
                     "• **OK**: 正常運作\n"
                     "• **consecutive errors**: 連續錯誤次數\n" 
-                    "• **total rate limits**: 總速率限制次數"
+                    "• **total rate limits**: 總速率限制次數\n"
+                    "• **backoff left**: 剩餘退避時間\n"
+                    "• **tokens**: 重置前剩餘的請求數\n"
+                    "• **Last checkpoint**: 上次保存狀態的時間"
                 ),
                 inline=False
             )
-            embed.set_footer(text="速率限制會自動使用指數退避策略處理")
+            embed.set_footer(text="速率限制會依令牌桶控制請求節奏，狀態會定期保存並在重啟後恢復")
             
             await ctx.send(embed=embed)
             
@@ -58,6 +61,7 @@ class RateLimitCommands(commands.Cog):
                     'last_error_time': None,
                     'total_rate_limits': 0
                 }
+                rate_limiter.dirty = True
                 
                 embed = discord.Embed(
                     title="✅ 速率限制記錄已重置",
@@ -1,35 +1,79 @@
-import os
+import asyncio
+from typing import Optional
 
-import aiosqlite
 import discord
 from discord import app_commands
 from discord.ext import commands
 
+from configs.load_configs import configs
 from core.classes import Cog_Extension
 from src.log import setup_logger
-from src.sync_db.sync_db import sync_db
-from src.db_function.readonly_db import connect_readonly
+from src.sync_db.sync_db import SyncJob, rebalance_db, sync_db
+from src.db_function.database import database
 
 log = setup_logger(__name__)
 
+SYNC_PROGRESS_INTERVAL = configs.get('sync_progress_interval', 10)
+
 
 class Sync(Cog_Extension):
+    job: Optional[SyncJob] = None
 
     @app_commands.default_permissions(administrator=True)
     @app_commands.command(name='sync')
-    async def sync(self, itn: discord.Interaction):
-        """To sync the notification of new Twitter account with database, use this command."""
+    async def sync(self, itn: discord.Interaction, rebalance: bool = False):
+        """To sync the notification of new Twitter account with database, use this command.
+
+        Parameters
+        -----------
+        rebalance: bool
+            Also move users from the busiest accounts to the least-loaded ones.
+        """
 
         await itn.response.defer(ephemeral=True)
 
-        async with connect_readonly(os.path.join(os.getenv('DATA_PATH'), 'tracked_accounts.db')) as db:
-            db.row_factory = aiosqlite.Row
+        if self.job is not None and not self.job.finished:
+            await itn.followup.send(f'a synchronization is already running, {self.job.summary()}', ephemeral=True)
+            return
+
+        async with database.reader() as db:
             async with db.execute('SELECT id, client_used FROM user') as cursor:
                 follow_list = {row[0]: row[1] async for row in cursor}
 
-        self.bot.loop.create_task(sync_db(follow_list))
+        job = self.job = SyncJob(len(follow_list))
+
+        async def sync_and_rebalance():
+            try:
+                await sync_db(follow_list, job)
+                if rebalance:
+                    await rebalance_db(self.move_task)
+            finally:
+                job.finished = True
+
+        task = self.bot.loop.create_task(sync_and_rebalance())
+        message = await itn.followup.send(job.summary(), ephemeral=True, wait=True)
+        self.bot.loop.create_task(self.report_progress(message, job, task))
+
+    async def report_progress(self, message: discord.WebhookMessage, job: SyncJob, task: asyncio.Task):
+        """Edit the /sync reply with the job's progress until it ends (or the interaction token expires)."""
+        while not task.done():
+            await asyncio.wait({task}, timeout=SYNC_PROGRESS_INTERVAL)
+            if task.cancelled():
+                # e.g. on shutdown or cog reload, the next /sync resumes from the checkpoint
+                log.warning('synchronization was cancelled before it completed')
+                return
+            if task.done() and task.exception() is not None:
+                log.error(f'an error occurred while synchronizing: {task.exception()}')
+            try:
+                await message.edit(content=job.summary())
+            except discord.HTTPException:
+                return
 
-        await itn.followup.send('synchronizing in the background', ephemeral=True)
+    async def move_task(self, username: str, client_used: str):
+        notification = self.bot.get_cog('Notification')
+        if notification is not None:
+            await notification.account_tracker.removeTask(username)
+            await notification.account_tracker.addTask(username, client_used)
 
 
 async def setup(bot: commands.Bot):
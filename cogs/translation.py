@@ -1,4 +1,3 @@
-import os
 import discord
 from discord import app_commands
 from discord.ext import commands
@@ -8,7 +7,10 @@ from core.classes import Cog_Extension
 from src.log import setup_logger
 
 # 暫時註解掉，等安裝套件後再啟用
-from src.translation.tweet_translator import TweetTranslator
+from src.translation.gemini_queue import MANUAL_PRIORITY
+from src.translation.progressive_edit import ProgressiveEdit
+from src.translation.translation_cache import translation_cache
+from src.translation.tweet_translator import get_translator
 
 log = setup_logger(__name__)
 
@@ -18,23 +20,18 @@ class Translation(Cog_Extension):
     
     def __init__(self, bot):
         super().__init__(bot)
-        self.translator = None
-        
-        # 從環境變數讀取 Gemini API 金鑰
-        gemini_api_key = os.getenv('GEMINI_API_KEY')
-        
-        if gemini_api_key:
-            try:
-                self.translator = TweetTranslator(gemini_api_key=gemini_api_key)
-                log.info("Gemini API 翻譯器初始化成功")
-            except Exception as e:
-                log.error(f"Gemini API 翻譯器初始化失敗: {e}")
-        else:
-            log.warning("未設定 GEMINI_API_KEY 環境變數，翻譯功能將無法使用")
+        # 與自動翻譯共用同一個翻譯器
+        self.translator = get_translator()
         
         if not self.translator:
             log.warning("翻譯器未初始化，翻譯功能將無法使用")
 
+    async def cog_unload(self):
+        # 翻譯器仍由自動翻譯共用，這裡只釋放閒置的連線，下次使用時會重新建立
+        if self.translator:
+            await self.translator.close()
+        await translation_cache.close()
+
     translate_group = app_commands.Group(
         name='translate', 
         description='翻譯相關功能'
@@ -86,8 +83,12 @@ class Translation(Cog_Extension):
             )
             await interaction.followup.send(embed=embed, ephemeral=True)
             
-            # 執行翻譯流程
-            result = await self.translator.translate_tweet(url, language)
+            async def show_progress(completed_text):
+                embed.description = f"🧠 AI 翻譯中...\n\n{completed_text[:4000]}"
+                await interaction.edit_original_response(embed=embed)
+            
+            # 執行翻譯流程，翻譯內容隨著段落完成逐步顯示
+            result = await self.translator.translate_tweet(url, language, priority=MANUAL_PRIORITY, on_progress=ProgressiveEdit(show_progress))
             
             if result["success"]:
                 # 翻譯成功 - 使用新的格式
@@ -210,7 +211,7 @@ class Translation(Cog_Extension):
             )
             await interaction.followup.send(embed=embed, ephemeral=True)
             
-            translated_text = await self.translator.translate_text(text, language, where, from_user)
+            translated_text = await self.translator.translate_text(text, language, where, from_user, priority=MANUAL_PRIORITY)
             
             if translated_text:
                 embed = discord.Embed(
@@ -1,6 +1,6 @@
 import os
 
-from src.db_function.readonly_db import connect_readonly
+from src.db_function.database import database
 from src.log import setup_logger
 
 log = setup_logger(__name__)
@@ -89,7 +89,7 @@ async def check_db(translation_only_mode=False) -> set[str]:
         log.warning('TWITTER_TOKEN not found, skipping database client check')
         return set()
     
-    async with connect_readonly(os.path.join(os.getenv('DATA_PATH'), 'tracked_accounts.db')) as db:
+    async with database.reader() as db:
         async with db.execute('SELECT client_used FROM user') as cursor:
             row = await cursor.fetchall()
             
@@ -0,0 +1,145 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import aiosqlite
+
+from configs.load_configs import configs
+from src.db_function.readonly_db import connect_readonly
+from src.log import setup_logger
+from src.utils import get_lock
+
+log = setup_logger(__name__)
+lock = get_lock()
+
+CACHED_STATEMENTS = 256
+
+
+class Database:
+    """
+    Long-lived connections to `tracked_accounts.db` shared by the whole bot.
+
+    There is a single writer connection, guarded by the process-wide lock, and a small pool of
+    read-only connections. The database runs in WAL mode so readers never block on the writer,
+    and each connection keeps its prepared statements cached across calls.
+    """
+
+    def __init__(self):
+        self.reader_count = max(1, configs.get('db_reader_pool_size', 4))
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._readers: Optional[asyncio.Queue] = None
+        self._all_readers: list[aiosqlite.Connection] = []
+        self._open_lock = asyncio.Lock()
+
+    @staticmethod
+    def path() -> str:
+        return os.path.join(os.getenv('DATA_PATH'), 'tracked_accounts.db')
+
+    async def open(self):
+        if self._writer is not None:
+            return
+
+        async with self._open_lock:
+            if self._writer is not None:
+                return
+
+            if not os.path.exists(os.getenv('DATA_PATH')):
+                os.mkdir(os.getenv('DATA_PATH'))
+
+            writer = await self._connect(aiosqlite.connect(self.path(), cached_statements=CACHED_STATEMENTS))
+            writer.row_factory = aiosqlite.Row
+            await writer.execute('PRAGMA journal_mode = WAL')
+            await writer.execute('PRAGMA synchronous = NORMAL')
+
+            readers = asyncio.Queue()
+            for _ in range(self.reader_count):
+                reader = await self._connect(connect_readonly(self.path(), cached_statements=CACHED_STATEMENTS))
+                reader.row_factory = aiosqlite.Row
+                readers.put_nowait(reader)
+                self._all_readers.append(reader)
+
+            self._writer, self._readers = writer, readers
+            log.info(f'database pool opened with 1 writer and {self.reader_count} readers')
+
+    @staticmethod
+    async def _connect(connection: aiosqlite.Connection) -> aiosqlite.Connection:
+        # pooled connections live as long as the process, so their worker threads must not keep it alive on shutdown
+        connection.daemon = True
+        return await connection
+
+    @asynccontextmanager
+    async def reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        while True:
+            await self.open()
+            readers = self._readers
+            db = await readers.get()
+            if db is not None:
+                break
+            # the pool was closed while waiting, wake the next waiter and retry on the reopened pool
+            readers.put_nowait(None)
+        try:
+            yield db
+        finally:
+            readers.put_nowait(db)
+
+    async def _acquire_writer(self) -> aiosqlite.Connection:
+        """Take the process-wide lock and return the writer connection, reopening the pool if it was closed meanwhile."""
+        while True:
+            await self.open()
+            await lock.acquire()
+            if self._writer is not None:
+                return self._writer
+            lock.release()
+
+    @asynccontextmanager
+    async def writer(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Hold the writer connection for one transaction, committed on success and rolled back on error."""
+        writer = await self._acquire_writer()
+        try:
+            yield writer
+            await writer.commit()
+        except BaseException:
+            await writer.rollback()
+            raise
+        finally:
+            lock.release()
+
+    async def checkpoint(self):
+        """Fold the WAL back into the main database file, e.g. before it is copied."""
+        writer = await self._acquire_writer()
+        try:
+            await writer.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        finally:
+            lock.release()
+
+    async def _close(self):
+        if self._writer is None:
+            return
+
+        # wait for every borrowed reader to come back so no connection is closed under a running query
+        readers = self._readers
+        for _ in self._all_readers:
+            await readers.get()
+        async with lock:
+            await self._writer.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            for reader in self._all_readers:
+                await reader.close()
+            await self._writer.close()
+        self._writer, self._readers, self._all_readers = None, None, []
+        # readers still waiting on the closed pool retry on the reopened one
+        readers.put_nowait(None)
+        log.info('database pool closed')
+
+    async def close(self):
+        async with self._open_lock:
+            await self._close()
+
+    @asynccontextmanager
+    async def offline(self) -> AsyncIterator[None]:
+        """Close the pool and keep it closed until the block ends, e.g. while the database file is replaced."""
+        async with self._open_lock:
+            await self._close()
+            yield
+
+database = Database()
@@ -0,0 +1,32 @@
+from datetime import datetime
+
+from src.db_function.database import database
+from src.log import setup_logger
+from src.notification.snowflake import current_snowflake, snowflake_from_datetime
+
+log = setup_logger(__name__)
+
+
+async def migrate_db():
+    async with database.writer() as db:
+        # users already synchronized by an unfinished /sync, so that it can resume
+        await db.execute('CREATE TABLE IF NOT EXISTS sync_progress (user_id TEXT, client_used TEXT, PRIMARY KEY(user_id, client_used))')
+
+        async with db.execute('PRAGMA table_info(user)') as cursor:
+            columns = {row['name'] async for row in cursor}
+
+        # high-water marks moved from the `lastest_tweet` TEXT timestamp to an INTEGER tweet ID
+        if 'lastest_tweet_id' not in columns:
+            await db.execute('ALTER TABLE user ADD COLUMN lastest_tweet_id INTEGER')
+            async with db.execute('SELECT id, lastest_tweet FROM user') as cursor:
+                rows = await cursor.fetchall()
+
+            updates = []
+            for user_id, lastest_tweet in rows:
+                try:
+                    updates.append((snowflake_from_datetime(datetime.fromisoformat(lastest_tweet)), user_id))
+                except (TypeError, ValueError):
+                    log.warning(f'invalid lastest_tweet value {lastest_tweet!r} for user {user_id}, using the current time instead')
+                    updates.append((current_snowflake(), user_id))
+            await db.executemany('UPDATE user SET lastest_tweet_id = ? WHERE id = ?', updates)
+            log.info(f'migrated the high-water marks of {len(updates)} users to tweet IDs')
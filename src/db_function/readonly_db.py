@@ -1,5 +1,5 @@
 import aiosqlite
 
-def connect_readonly(db_path: str):
+def connect_readonly(db_path: str, **kwargs):
     uri = f'file:{db_path}?mode=ro'
-    return aiosqlite.connect(uri, uri=True)
+    return aiosqlite.connect(uri, uri=True, **kwargs)
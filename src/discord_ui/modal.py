@@ -1,11 +1,7 @@
-import os
-
-import aiosqlite
 import discord
 
-from src.utils import get_lock
-
-lock = get_lock()
+from src.notification.subscription_index import subscription_index
+from src.db_function.database import database
 
 class CustomizeMsgModal(discord.ui.Modal, title='customize message'):
     def __init__(self, user_id: str, username: str, channel: discord.TextChannel):
@@ -23,10 +19,8 @@ class CustomizeMsgModal(discord.ui.Modal, title='customize message'):
     async def on_submit(self, itn: discord.Interaction):
         await itn.response.defer(ephemeral=True)
 
-        async with aiosqlite.connect(os.path.join(os.getenv('DATA_PATH'), 'tracked_accounts.db')) as db:
-            db.row_factory = aiosqlite.Row
-            async with lock:
-                await db.execute('UPDATE notification SET customized_msg = ? WHERE user_id = ? AND channel_id = ?', (self.customized_msg.value, self.user_id, str(self.channel.id)))
-                await db.commit()
+        async with database.writer() as db:
+            await db.execute('UPDATE notification SET customized_msg = ? WHERE user_id = ? AND channel_id = ?', (self.customized_msg.value, self.user_id, str(self.channel.id)))
+        await subscription_index.refresh_user(self.user_id)
 
         await itn.followup.send('setting successful', ephemeral=True)
@@ -1,28 +1,36 @@
 import asyncio
 import os
-import sys
-import re
+from collections import defaultdict
 from datetime import datetime, timezone, timedelta
 
-import aiosqlite
 import discord
 from discord.ext import commands
 from tweety import Twitter
+from tweety.types import Tweet
 
 from configs.load_configs import configs
 from src.log import setup_logger
-from src.notification.display_tools import gen_embed, get_action
+from src.notification.display_tools import TweetPayload, render_tweet
+from src.notification.error_classifier import AUTH_EXPIRED, RATE_LIMIT, TRANSIENT, classify_error
 from src.notification.get_tweets import get_tweets
-from src.notification.utils import is_match_media_type, is_match_type, replace_emoji
-from src.notification.rate_limiter import rate_limiter
-from src.utils import get_accounts, get_lock
-from src.db_function.readonly_db import connect_readonly
+from src.notification.message_template import message_templates
+from src.notification.utils import is_match_media_type, is_match_type
+from src.notification.client_pool import client_pool
+from src.notification.cursor_store import cursor_store
+from src.notification.load_balancer import load_balancer
+from src.notification.poll_scheduler import poll_scheduler
+from src.notification.rate_limiter import TIMELINE_ENDPOINT, rate_limiter
+from src.notification.snowflake import tweet_id
+from src.notification.subscription_index import subscription_index
+from src.notification.task_supervisor import TaskSupervisor
+from src.utils import get_accounts
+from src.db_function.database import database
 
-EMBED_TYPE = configs['embed']['type'] if configs['embed']['type'] in ['built_in', 'fx_twitter'] else 'built_in'
-DOMAIN_NAME = configs['embed']['fx_twitter']['domain_name'] if configs['embed']['fx_twitter']['domain_name'] in ['fxtwitter', 'fixupx'] else 'fxtwitter'
+DISPATCHER_MODE = configs.get('dispatcher_mode', True)
+FAILOVER_CHECK_PERIOD = configs.get('failover_check_period', 60)
+TRANSIENT_RETRY_DELAY = configs.get('tweets_updater_transient_retry_delay', 15)
 
 log = setup_logger(__name__)
-lock = get_lock()
 
 class AccountTracker():
     def __init__(self, bot: commands.Bot):
@@ -30,17 +38,38 @@ class AccountTracker():
         self.accounts_data = get_accounts()
         self.db_path = os.path.join(os.getenv('DATA_PATH'), 'tracked_accounts.db')
         self.tweets = {account_name: [] for account_name in self.accounts_data.keys()}
+        self.users: dict[str, str] = {}  # username -> client_used of every enabled user
+        self.apps: dict[str, Twitter] = {}  # client name -> authenticated client
+        self.delivery_semaphore = asyncio.Semaphore(max(1, configs.get('delivery_concurrency', 10)))
+        self.failover_cursor = 0  # index of the next failed-over user to serve, kept across failover rounds
+        self.supervisor = TaskSupervisor(bot.loop)
+        self.authenticators: dict[str, asyncio.Task] = {}  # client name -> background authentication that has not succeeded yet
         self.tasksMonitorLogAt = datetime.now(timezone.utc) - timedelta(hours=configs['tasks_monitor_log_period'])
-        bot.loop.create_task(self.setup_tasks())
+        self.setup_task = bot.loop.create_task(self.setup_tasks())
+
+    def stop(self):
+        """Cancel every task of the tracker, including setup and pending authentications, so a reloaded cog starts from a clean slate."""
+        self.setup_task.cancel()
+        for authenticator in self.authenticators.values():
+            authenticator.cancel()
+        self.authenticators.clear()
+        self.supervisor.stop_all()
 
     async def setup_tasks(self):
-        async def authenticate_account(account_name, account_token):
-            app = Twitter(account_name)
+        await subscription_index.load()
+        await cursor_store.load()
+        self.supervisor.start('CursorStore', cursor_store.run)
+        rate_limiter.load()
+        self.supervisor.start('RateLimitCheckpoint', rate_limiter.run)
+
+        usernames_and_clients = await self.load_users()
+        self.users = usernames_and_clients
+
+        async def authenticate_account(account_name):
             max_attempts = configs['auth_max_attempts']
             for attempt in range(max_attempts):
                 try:
-                    await app.load_auth_token(account_token)
-                    return app
+                    return await client_pool.get(account_name)
                 except Exception:
                     log.error(f"Authentication failed for account: {account_name} [Attempt {attempt + 1}/{max_attempts}]")
                     if attempt < max_attempts - 1:
@@ -48,21 +77,47 @@ class AccountTracker():
                     else:
                         log.error(f"Persistent authentication failure for account {account_name}")
                         raise
-        
-        for account_name, account_token in self.accounts_data.items():
-            try:
-                app = await authenticate_account(account_name, account_token)
-                self.bot.loop.create_task(self.tweetsUpdater(app)).set_name(f'TweetsUpdater_{account_name}')
-            except Exception:
-                sys.exit(1)
 
-        async with connect_readonly(self.db_path) as db:
-            async with db.execute('SELECT username, client_used FROM user WHERE enabled = 1') as cursor:
-                usernames_and_clients = {row[0]: row[1] async for row in cursor}
+        async def start_account(account_name):
+            # a client starts polling as soon as it is authenticated, without waiting for the others
+            while True:
+                try:
+                    app = await authenticate_account(account_name)
+                    break
+                except Exception:
+                    log.error(f"{account_name} will retry authentication in the background in {configs['tweets_updater_retry_delay']} minutes, its users are served by the other clients meanwhile")
+                    await asyncio.sleep(configs['tweets_updater_retry_delay'] * 60)
+            self.apps[account_name] = app
+            self.authenticators.pop(account_name, None)
+            self.supervisor.start(f'TweetsUpdater_{account_name}', lambda: self.tweetsUpdater(app))
+
+        for account_name in self.accounts_data.keys():
+            self.authenticators[account_name] = self.bot.loop.create_task(start_account(account_name), name=f'Authenticator_{account_name}')
+
+        self.supervisor.start('FailoverMonitor', self.failoverMonitor)
+        self.supervisor.start('TasksMonitor', self.tasksMonitor)
+
+        if DISPATCHER_MODE:
+            return
 
         for username, client_used in usernames_and_clients.items():
-            self.bot.loop.create_task(self.notification(username, client_used)).set_name(username)
-        self.bot.loop.create_task(self.tasksMonitor(usernames_and_clients)).set_name('TasksMonitor')
+            self.supervisor.start(username, lambda username=username, client_used=client_used: self.notification(username, client_used))
+
+    @staticmethod
+    async def load_users() -> dict[str, str]:
+        async with database.reader() as db:
+            async with db.execute('SELECT username, client_used FROM user WHERE enabled = 1') as cursor:
+                return {row[0]: row[1] async for row in cursor}
+
+    async def reload_users(self):
+        """Re-read the enabled users after the database was replaced, adding, removing and moving their tasks to match."""
+        users = await self.load_users()
+        for username, client_used in list(self.users.items()):
+            if users.get(username) != client_used:
+                await self.removeTask(username)
+        for username, client_used in users.items():
+            if self.users.get(username) != client_used:
+                await self.addTask(username, client_used)
 
     async def notification(self, username: str, client_used: str):
         while True:
@@ -71,61 +126,78 @@ class AccountTracker():
             lastest_tweets = await get_tweets(self.tweets[client_used], username)
             if lastest_tweets is None:
                 continue
-            
-            async with aiosqlite.connect(self.db_path) as db:
-                db.row_factory = aiosqlite.Row
-                async with db.cursor() as cursor:
-                    await cursor.execute('SELECT * FROM user WHERE username = ?', (username,))
-                    user = await cursor.fetchone()
-                    async with lock:
-                        await cursor.execute('UPDATE user SET lastest_tweet = ? WHERE username = ?', (str(lastest_tweets[-1].created_on), username))
-                        await db.commit()
-
-                    for tweet in lastest_tweets:
-                        log.info(f'find a new tweet from {username}')
-                        url = re.sub('twitter', DOMAIN_NAME, tweet.url) if EMBED_TYPE == 'fx_twitter' else tweet.url
-                        
-                        view, create_view = None, False
-                        if bool(tweet.media) and tweet.media[0].type == 'video' and EMBED_TYPE == 'built_in' and configs['embed']['built_in']['video_link_button']:
-                            create_view = True
-                            button_label, button_url = 'View Video', tweet.media[0].expanded_url
-                        elif EMBED_TYPE == 'fx_twitter' and configs['embed']['fx_twitter']['original_url_button']:
-                            create_view = True
-                            button_label, button_url = 'View Original', tweet.url
-
-                        if create_view:
-                            view = discord.ui.View()
-                            view.add_item(discord.ui.Button(label=button_label, style=discord.ButtonStyle.link, url=button_url))
-                        
-                        await cursor.execute('SELECT * FROM notification WHERE user_id = ? AND enabled = 1', (user['id'],))
-                        notifications = await cursor.fetchall()
-                        for data in notifications:
-                            channel = self.bot.get_channel(int(data['channel_id']))
-                            if channel is not None and is_match_type(tweet, data['enable_type']) and is_match_media_type(tweet, data['enable_media_type']):
-                                try:
-                                    mention = f"{channel.guild.get_role(int(data['role_id'])).mention} " if data['role_id'] else ''
-                                    author, action = tweet.author.name, get_action(tweet)
-                                    
-                                    if not data['customized_msg']:
-                                        msg = configs['default_message']
-                                    else:
-                                        msg = re.sub(r":(\w+):", lambda match: replace_emoji(match, channel.guild), data['customized_msg']) if configs['emoji_auto_format'] else data['customized_msg']
-                                    msg = msg.format(mention=mention, author=author, action=action, url=url)
-
-                                    if EMBED_TYPE == 'fx_twitter':
-                                        await channel.send(msg, view=view)
-                                    else:
-                                        footer = 'twitter.png' if configs['embed']['built_in']['legacy_logo'] else 'x.png'
-                                        file = discord.File(f'images/{footer}', filename='footer.png')
-                                        await channel.send(msg, file=file, embeds=await gen_embed(tweet), view=view)
-
-                                except Exception as e:
-                                    if not isinstance(e, discord.errors.Forbidden):
-                                        log.error(f'an error occurred at {channel.mention} while sending notification: {e}')
+
+            await self.deliver(username, lastest_tweets)
+
+    async def dispatch(self, client_used: str):
+        """Fan out one tweetsUpdater refresh to the users served by `client_used`, grouping the tweets by author in a single pass."""
+        tweets_by_author: dict[str, list] = defaultdict(list)
+        for tweet in self.tweets[client_used]:
+            tweets_by_author[tweet.author.username].append(tweet)
+
+        async def dispatch_user(username: str, tweets: list):
+            lastest_tweets = await get_tweets(tweets, username)
+            if lastest_tweets is not None:
+                await self.deliver(username, lastest_tweets)
+
+        # users of a client in failover are also served from any healthy client whose feed contains their tweets
+        results = await asyncio.gather(*(dispatch_user(username, tweets) for username, tweets in tweets_by_author.items() if self.users.get(username) == client_used or self.users.get(username) in rate_limiter.failovers), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                log.error(f'an error occurred while dispatching tweets of {client_used}: {result}')
+
+    async def deliver(self, username: str, lastest_tweets: list):
+        # filtered again right before remembering them, since another client may have delivered the same tweets meanwhile
+        lastest_tweets = [tweet for tweet in lastest_tweets if not cursor_store.is_recent(username, tweet_id(tweet))]
+        if not lastest_tweets:
+            return
+        cursor_store.remember(username, [tweet_id(tweet) for tweet in lastest_tweets])
+        await cursor_store.commit(username, tweet_id(lastest_tweets[-1]))
+
+        user = subscription_index.get_user(username)
+        if user is None:
+            return
+
+        for tweet in lastest_tweets:
+            log.info(f'find a new tweet from {username}')
+            channels = []
+            for data in subscription_index.get_notifications(user['id']):
+                channel = self.bot.get_channel(int(data['channel_id']))
+                if channel is not None and is_match_type(tweet, data['enable_type']) and is_match_media_type(tweet, data['enable_media_type']):
+                    channels.append((channel, data))
+            if not channels:
+                continue
+
+            try:
+                payload = await render_tweet(tweet)
+            except Exception as e:
+                log.error(f'an error occurred while rendering a tweet from {username}: {e}')
+                continue
+            await asyncio.gather(*(self.send_notification(payload, channel, data) for channel, data in channels))
+
+    async def send_notification(self, payload: TweetPayload, channel: discord.abc.Messageable, data: dict):
+        """Send one rendered tweet to one notification channel; a failure here never affects the other channels of the tweet."""
+        # discord.py already queues each send on its per-channel route bucket, the semaphore only caps how many are in flight
+        async with self.delivery_semaphore:
+            try:
+                mention = f"{channel.guild.get_role(int(data['role_id'])).mention} " if data['role_id'] else ''
+                msg = message_templates.get(channel, data).format(mention=mention, author=payload.author, action=payload.action, url=payload.url)
+
+                if payload.embeds is None:
+                    await channel.send(msg, view=payload.view)
+                else:
+                    await channel.send(msg, file=payload.footer_file(), embeds=payload.embeds, view=payload.view)
+
+            except Exception as e:
+                if not isinstance(e, discord.errors.Forbidden):
+                    log.error(f'an error occurred at {channel.mention} while sending notification: {e}')
 
     async def tweetsUpdater(self, app: Twitter):
         updater_name = asyncio.current_task().get_name().split('_', 1)[1]
         base_delay = configs['tweets_check_period']
+        # 重啟後先等待尚未結束的退避或視窗重置，避免所有帳戶同時重新請求
+        await asyncio.sleep(max(poll_scheduler.start_delay(updater_name, list(self.accounts_data.keys())), rate_limiter.get_remaining_backoff(updater_name), rate_limiter.get_pacing_delay(updater_name)))
+        transient_errors, reauthenticated = 0, False
         
         while True:
             # 檢查是否應該跳過請求（當速率限制過於頻繁時）
@@ -135,46 +207,117 @@ class AccountTracker():
                 continue
             
             try:
-                self.tweets[updater_name] = await app.get_tweet_notifications()
-                # 成功獲取推文，記錄成功
+                # sorted once per refresh so every get_tweets call can stop at its high-water mark
+                self.tweets[updater_name] = sorted(await app.get_tweet_notifications(), key=tweet_id)
+                # 成功獲取推文，記錄成功並以回應標頭校正令牌桶
+                rate_limiter.record_request(updater_name, app.rate_limits)
                 rate_limiter.record_success(updater_name)
-                await asyncio.sleep(base_delay)
+                transient_errors, reauthenticated = 0, False
+                if DISPATCHER_MODE:
+                    await self.dispatch(updater_name)
+                newest_id = tweet_id(self.tweets[updater_name][-1]) if self.tweets[updater_name] else 0
+                # 依剩餘令牌控制請求節奏，不等到 429 才退避
+                await asyncio.sleep(max(poll_scheduler.next_delay(updater_name, newest_id), rate_limiter.get_pacing_delay(updater_name)))
                 
             except Exception as e:
-                # 檢查是否為速率限制錯誤
-                if rate_limiter.is_rate_limited_error(e):
+                error_type = classify_error(e)
+                if error_type == RATE_LIMIT:
+                    rate_limiter.record_request(updater_name, app.rate_limits)
                     rate_limiter.record_rate_limit(updater_name, e)
                     delay_seconds = rate_limiter.get_backoff_delay(updater_name)
                     await asyncio.sleep(delay_seconds)
+                
+                elif error_type == AUTH_EXPIRED and not reauthenticated:
+                    # 憑證失效：立即重新載入 auth token 後重試，只嘗試一次以免重複登入
+                    log.warning(f'{e} (task : tweets updater {updater_name}), reloading the auth token')
+                    reauthenticated = True
+                    try:
+                        await client_pool.reauthenticate(updater_name)
+                    except Exception as auth_error:
+                        log.error(f'failed to reload the auth token of {updater_name}: {auth_error}')
+                        await asyncio.sleep(configs['tweets_updater_retry_delay'] * 60)
+                
+                elif error_type == TRANSIENT:
+                    # 暫時性網路錯誤：以短暫且逐次加倍的間隔重試
+                    delay_seconds = min(TRANSIENT_RETRY_DELAY * 2 ** transient_errors, configs['tweets_updater_retry_delay'] * 60)
+                    transient_errors += 1
+                    log.warning(f'{e} (task : tweets updater {updater_name}), try again in {delay_seconds} seconds')
+                    await asyncio.sleep(delay_seconds)
                     
                 else:
-                    # 非速率限制錯誤：使用原本的錯誤處理
+                    # 永久性錯誤（或重新登入後仍失效）：使用原本的錯誤處理
                     log.error(f'{e} (task : tweets updater {updater_name})')
                     log.error(f"an unexpected error occurred, try again in {configs['tweets_updater_retry_delay']} minutes")
                     await asyncio.sleep(configs['tweets_updater_retry_delay'] * 60)
+                    reauthenticated = False
 
-    async def tasksMonitor(self, users_and_clients: dict[str, str]):
+    async def failoverMonitor(self):
+        """While a client is in backoff, fetch the timelines of its users with the healthy clients and route them back once it recovers."""
         while True:
-            taskSet = {task.get_name() for task in asyncio.all_tasks()}
-            users = {username for username, _ in users_and_clients.items()}
-            aliveTasks = taskSet & users
-
-            if aliveTasks != users:
-                deadTasks = list(users - aliveTasks)
-                log.warning(f'dead tasks : {deadTasks}')
-                for deadTask in deadTasks:
-                    self.bot.loop.create_task(self.notification(deadTask, users_and_clients[deadTask])).set_name(deadTask)
-                    log.info(f'restart {deadTask} successfully using {users_and_clients[deadTask]}')
+            await asyncio.sleep(FAILOVER_CHECK_PERIOD)
 
             for client in self.accounts_data.keys():
-                if f'TweetsUpdater_{client}' not in taskSet:
-                    log.warning(f'tweets updater {client} : dead')
+                # a client that is not authenticated yet is failed over too
+                unavailable = client not in self.apps or rate_limiter.is_in_backoff(client)
+                if unavailable and client not in rate_limiter.failovers:
+                    rate_limiter.failovers.add(client)
+                    log.warning(f'{client} is unavailable, its users are temporarily served by the other clients')
+                elif not unavailable and client in rate_limiter.failovers:
+                    rate_limiter.failovers.discard(client)
+                    log.info(f'{client} recovered, its users are routed back')
+
+            usernames = [username for username, client_used in self.users.items() if client_used in rate_limiter.failovers]
+            if not usernames:
+                continue
+            healthy_clients = [client for client in list(self.apps.keys()) if client not in rate_limiter.failovers]
+
+            # spread the fallback fetches over the healthy clients, least rate limited first, and start where the last round stopped
+            healthy_clients.sort(key=lambda client: load_balancer.weight(client))
+            start, served, turn = self.failover_cursor % len(usernames), 0, 0
+            while served < len(usernames) and healthy_clients:
+                username = usernames[(start + served) % len(usernames)]
+                user = subscription_index.get_user(username)
+                if user is None:
+                    served += 1
+                    continue
+
+                client = healthy_clients[turn % len(healthy_clients)]
+                if not rate_limiter.has_budget(client, TIMELINE_ENDPOINT):
+                    healthy_clients.remove(client)
+                    continue
+                turn += 1
+
+                app = self.apps[client]
+                try:
+                    tweets = await app.get_tweets(user['id'])
+                    rate_limiter.record_request(client, app.rate_limits, TIMELINE_ENDPOINT)
+                    lastest_tweets = await get_tweets(sorted((tweet for tweet in tweets if isinstance(tweet, Tweet)), key=tweet_id), username)
+                    if lastest_tweets is not None:
+                        await self.deliver(username, lastest_tweets)
+                except Exception as e:
+                    if rate_limiter.is_rate_limited_error(e):
+                        # only this client is out of timeline budget, the user is retried with the next one
+                        rate_limiter.record_request(client, app.rate_limits, TIMELINE_ENDPOINT)
+                        rate_limiter.exhaust(client, e, TIMELINE_ENDPOINT)
+                        healthy_clients.remove(client)
+                        log.warning(f'{client} hit the rate limit while serving failed-over users, dropping it for this round')
+                        continue
+                    log.error(f'an error occurred while fetching {username} for failover: {e}')
+                served += 1
+                await asyncio.sleep(1)
 
+            self.failover_cursor = (start + served) % len(usernames)
+            if served < len(usernames):
+                log.warning(f'{len(usernames) - served} of {len(usernames)} failed-over users were not covered this round, they are served first next round')
+
+    async def tasksMonitor(self):
+        """Periodic status report; crashed tasks are restarted by the supervisor as soon as they stop."""
+        while True:
             if (datetime.now(timezone.utc) - self.tasksMonitorLogAt).total_seconds() / 3600 >= configs['tasks_monitor_log_period']:
-                log.info(f'alive tasks : {list(aliveTasks)}')
+                if not DISPATCHER_MODE:
+                    log.info(f'alive tasks : {[username for username in self.users if self.supervisor.is_alive(username)]}')
                 for client in self.accounts_data.keys():
-                    if f'TweetsUpdater_{client}' in taskSet:
-                        log.info(f'tweets updater {client} : alive')
+                    log.info(f'tweets updater {client} : alive') if self.supervisor.is_alive(f'TweetsUpdater_{client}') else log.warning(f'tweets updater {client} : dead')
                 
                 # 記錄速率限制狀態
                 log.info(rate_limiter.get_status_summary())
@@ -183,39 +326,19 @@ class AccountTracker():
             await asyncio.sleep(configs['tasks_monitor_check_period'] * 60)
 
     async def addTask(self, username: str, client_used: str):
-        self.bot.loop.create_task(self.notification(username, client_used)).set_name(username)
-        log.info(f'new task {username} added successfully using {client_used}')
+        self.users[username] = client_used
+        if DISPATCHER_MODE:
+            log.info(f'new user {username} added to the dispatcher using {client_used}')
+            return
 
-        for task in asyncio.all_tasks():
-            if task.get_name() == 'TasksMonitor':
-                try:
-                    log.info('existing TasksMonitor has been closed') if task.cancel() else log.info('existing TasksMonitor failed to close')
-                except Exception as e:
-                    log.warning(f'addTask : {e}')
-
-        async with connect_readonly(self.db_path) as db:
-            async with db.execute('SELECT username, client_used FROM user WHERE enabled = 1') as cursor:
-                usernames_and_clients = {row[0]: row[1] async for row in cursor}
-        self.bot.loop.create_task(self.tasksMonitor(usernames_and_clients)).set_name('TasksMonitor')
-        log.info('new TasksMonitor has been started')
+        self.supervisor.start(username, lambda: self.notification(username, client_used))
+        log.info(f'new task {username} added successfully using {client_used}')
 
     async def removeTask(self, username: str):
-        for task in asyncio.all_tasks():
-            if task.get_name() == 'TasksMonitor':
-                try:
-                    log.info('existing TasksMonitor has been closed') if task.cancel() else log.info('existing TasksMonitor failed to close')
-                except Exception as e:
-                    log.warning(f'removeTask : {e}')
+        self.users.pop(username, None)
+        if DISPATCHER_MODE:
+            log.info(f'user {username} removed from the dispatcher')
+            return
 
-        for task in asyncio.all_tasks():
-            if task.get_name() == username:
-                try:
-                    log.info(f'existing task {username} has been closed') if task.cancel() else log.info(f'existing task {username} failed to close')
-                except Exception as e:
-                    log.warning(f'removeTask : {e}')
-
-        async with connect_readonly(self.db_path) as db:
-            async with db.execute('SELECT username, client_used FROM user WHERE enabled = 1') as cursor:
-                usernames_and_clients = {row[0]: row[1] async for row in cursor}
-        self.bot.loop.create_task(self.tasksMonitor(usernames_and_clients)).set_name('TasksMonitor')
-        log.info('new TasksMonitor has been started')
+        self.supervisor.stop(username)
+        log.info(f'existing task {username} has been closed')
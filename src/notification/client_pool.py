@@ -0,0 +1,67 @@
+import asyncio
+import os
+from typing import Optional
+
+from tweety import Twitter
+
+from configs.load_configs import configs
+from src.log import setup_logger
+from src.utils import get_accounts
+
+log = setup_logger(__name__)
+
+
+class ClientPool:
+    """
+    One authenticated `Twitter` client per `TWITTER_TOKEN` account, shared by the whole bot.
+
+    Sessions are saved under `DATA_PATH/sessions`. On a warm restart the saved session is verified with
+    `connect` and `load_auth_token` only runs when it is missing, belongs to another token or is no longer valid.
+    """
+
+    def __init__(self):
+        self.auth_timeout = configs.get('auth_timeout', 30)
+        self.clients: dict[str, Twitter] = {}
+        self.locks: dict[str, asyncio.Lock] = {}
+
+    @staticmethod
+    def session_path(account_name: str) -> str:
+        return os.path.join(os.getenv('DATA_PATH'), 'sessions', f'{account_name}.tw_session')
+
+    async def get(self, account_name: str) -> Twitter:
+        """The authenticated client of `account_name`, authenticating it on first use."""
+        if account_name in self.clients:
+            return self.clients[account_name]
+
+        async with self.locks.setdefault(account_name, asyncio.Lock()):
+            if account_name not in self.clients:
+                self.clients[account_name] = await self.authenticate(account_name)
+            return self.clients[account_name]
+
+    async def authenticate(self, account_name: str, app: Optional[Twitter] = None) -> Twitter:
+        token = get_accounts()[account_name]
+        if app is None:
+            os.makedirs(os.path.dirname(self.session_path(account_name)), exist_ok=True)
+            app = Twitter(self.session_path(account_name))
+
+            # reuse the saved session if it was created from the same token and X still accepts it
+            if app.session.logged_in and app.session.cookies_dict().get('auth_token') == token:
+                try:
+                    await asyncio.wait_for(app.connect(), self.auth_timeout)
+                    log.info(f'reused the saved session of {account_name}')
+                    return app
+                except Exception as e:
+                    log.warning(f'saved session of {account_name} is no longer valid, logging in again: {e}')
+
+        await asyncio.wait_for(app.load_auth_token(token), self.auth_timeout)
+        log.info(f'logged in to {account_name}')
+        return app
+
+    async def reauthenticate(self, account_name: str) -> Twitter:
+        """Reload the auth token of an existing client in place, e.g. after its credentials expired."""
+        async with self.locks.setdefault(account_name, asyncio.Lock()):
+            self.clients[account_name] = await self.authenticate(account_name, self.clients.get(account_name))
+            return self.clients[account_name]
+
+
+client_pool = ClientPool()
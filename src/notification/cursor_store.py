@@ -0,0 +1,128 @@
+import asyncio
+from collections import defaultdict
+from typing import Optional
+
+from configs.load_configs import configs
+from src.db_function.database import database
+from src.log import setup_logger
+
+log = setup_logger(__name__)
+
+
+class CursorStore:
+    """
+    Per-user high-water marks (`user.lastest_tweet_id`) kept in memory and flushed to SQLite in batches.
+
+    Every mark advanced within one `cursor_flush_interval` window is written by a single `executemany`
+    transaction. `commit` only returns once the mark is durable, so notifications are sent after their
+    high-water mark is on disk and a crash can never make the bot deliver the same tweet twice.
+    The IDs of the last `recent_tweet_ids_size` delivered tweets of each user are also remembered,
+    so a tweet seen again by a later refresh is never delivered twice even if the mark was reset.
+    When a batch fails its marks are written one at a time, and a mark that still fails after
+    `cursor_flush_max_attempts` flushes is dropped so it cannot hold back the other users' deliveries.
+    """
+
+    def __init__(self):
+        self.marks: dict[str, int] = {}  # username -> lastest_tweet_id
+        self.dirty: dict[str, int] = {}
+        self.waiters: dict[str, list[asyncio.Future]] = defaultdict(list)  # username -> commits waiting for its mark
+        self.failures: dict[str, int] = {}  # username -> failed flushes of its pending mark
+        self.flush_interval = configs.get('cursor_flush_interval', 0.5)
+        self.max_attempts = max(1, configs.get('cursor_flush_max_attempts', 3))
+        self.recent_ids: dict[str, dict[int, None]] = defaultdict(dict)  # username -> insertion-ordered set of delivered tweet IDs
+        self.recent_ids_size = max(1, configs.get('recent_tweet_ids_size', 100))
+        self._pending = asyncio.Event()
+
+    async def load(self):
+        async with database.reader() as db:
+            async with db.execute('SELECT username, lastest_tweet_id FROM user') as cursor:
+                self.marks = {row[0]: row[1] async for row in cursor}
+        self.marks.update(self.dirty)
+
+    async def get(self, username: str) -> Optional[int]:
+        if username not in self.marks:
+            async with database.reader() as db:
+                async with db.execute('SELECT lastest_tweet_id FROM user WHERE username = ?', (username,)) as cursor:
+                    row = await cursor.fetchone()
+            if row is None:
+                return None
+            self.marks.setdefault(username, row[0])
+        return self.marks[username]
+
+    def advance(self, username: str, mark: int):
+        # marks only move forward, even when two clients deliver the same user concurrently
+        mark = max(mark, self.marks.get(username) or 0)
+        self.marks[username] = mark
+        self.dirty[username] = mark
+        self._pending.set()
+
+    def is_recent(self, username: str, tweet_id: int) -> bool:
+        return tweet_id in self.recent_ids.get(username, ())
+
+    def remember(self, username: str, tweet_ids: list[int]):
+        recent = self.recent_ids[username]
+        for tweet_id in tweet_ids:
+            recent[tweet_id] = None
+        while len(recent) > self.recent_ids_size:
+            del recent[next(iter(recent))]
+
+    async def commit(self, username: str, mark: int):
+        """Advance the mark of `username` and wait until the batch containing it has been flushed."""
+        self.advance(username, mark)
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters[username].append(waiter)
+        await waiter
+
+    async def flush(self) -> bool:
+        batch, self.dirty = self.dirty, {}
+        waiters, self.waiters = self.waiters, defaultdict(list)
+        failed = {}
+        if batch:
+            try:
+                async with database.writer() as db:
+                    await db.executemany('UPDATE user SET lastest_tweet_id = ? WHERE username = ?', [(mark, username) for username, mark in batch.items()])
+            except Exception as e:
+                log.warning(f'failed to flush {len(batch)} high-water marks in one batch, writing them one at a time: {e}')
+                failed = await self._flush_each(batch)
+
+        retrying = False
+        for username in batch:
+            if username not in failed:
+                self.failures.pop(username, None)
+            elif self.failures.get(username, 0) + 1 >= self.max_attempts:
+                # delivered anyway, the in-memory mark and the recent tweet IDs still prevent duplicates until a restart
+                self.failures.pop(username, None)
+                log.error(f'dropped the high-water mark of {username} after {self.max_attempts} failed flushes: {failed[username]}')
+            else:
+                # keep the mark (unless a newer one arrived meanwhile) and its waiters, and retry on the next tick
+                self.failures[username] = self.failures.get(username, 0) + 1
+                self.dirty.setdefault(username, batch[username])
+                self.waiters[username] = waiters.pop(username, []) + self.waiters[username]
+                retrying = True
+                continue
+            for waiter in waiters.pop(username, []):
+                if not waiter.done():
+                    waiter.set_result(None)
+        return not retrying
+
+    async def _flush_each(self, batch: dict[str, int]) -> dict[str, Exception]:
+        """Write every mark of `batch` in its own transaction and return the errors of those that failed."""
+        failed = {}
+        for username, mark in batch.items():
+            try:
+                async with database.writer() as db:
+                    await db.execute('UPDATE user SET lastest_tweet_id = ? WHERE username = ?', (mark, username))
+            except Exception as e:
+                failed[username] = e
+        return failed
+
+    async def run(self):
+        while True:
+            await self._pending.wait()
+            await asyncio.sleep(self.flush_interval)
+            self._pending.clear()
+            if not await self.flush():
+                self._pending.set()
+
+
+cursor_store = CursorStore()
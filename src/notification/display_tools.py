@@ -1,11 +1,56 @@
+import io
 import re
+from typing import Optional
 
-import aiohttp
 import discord
-from bs4 import BeautifulSoup
 from tweety.types import Tweet
 
 from configs.load_configs import configs
+from src.log import setup_logger
+from src.notification.og_image import og_image_resolver
+
+log = setup_logger(__name__)
+
+EMBED_TYPE = configs['embed']['type'] if configs['embed']['type'] in ['built_in', 'fx_twitter'] else 'built_in'
+DOMAIN_NAME = configs['embed']['fx_twitter']['domain_name'] if configs['embed']['fx_twitter']['domain_name'] in ['fxtwitter', 'fixupx'] else 'fxtwitter'
+
+# read once at startup, every notification gets its own in-memory copy
+with open(f"images/{'twitter.png' if configs['embed']['built_in']['legacy_logo'] else 'x.png'}", 'rb') as footer_image:
+    FOOTER_IMAGE = footer_image.read()
+
+
+class TweetPayload():
+    """The parts of a notification that are the same for every channel, rendered once per tweet by `render_tweet`."""
+
+    def __init__(self, tweet: Tweet, url: str, embeds: Optional[list[discord.Embed]], view: Optional[discord.ui.View]):
+        self.tweet = tweet
+        self.url = url
+        self.author = tweet.author.name
+        self.action = get_action(tweet)
+        self.embeds = embeds
+        self.view = view
+
+    def footer_file(self) -> discord.File:
+        return discord.File(io.BytesIO(FOOTER_IMAGE), filename='footer.png')
+
+
+async def render_tweet(tweet: Tweet) -> TweetPayload:
+    url = re.sub('twitter', DOMAIN_NAME, tweet.url) if EMBED_TYPE == 'fx_twitter' else tweet.url
+
+    view, create_view = None, False
+    if bool(tweet.media) and tweet.media[0].type == 'video' and EMBED_TYPE == 'built_in' and configs['embed']['built_in']['video_link_button']:
+        create_view = True
+        button_label, button_url = 'View Video', tweet.media[0].expanded_url
+    elif EMBED_TYPE == 'fx_twitter' and configs['embed']['fx_twitter']['original_url_button']:
+        create_view = True
+        button_label, button_url = 'View Original', tweet.url
+
+    if create_view:
+        view = discord.ui.View()
+        view.add_item(discord.ui.Button(label=button_label, style=discord.ButtonStyle.link, url=button_url))
+
+    embeds = await gen_embed(tweet) if EMBED_TYPE == 'built_in' else None
+    return TweetPayload(tweet, url, embeds, view)
 
 
 async def gen_embed(tweet: Tweet) -> list[discord.Embed]:
@@ -18,11 +63,14 @@ async def gen_embed(tweet: Tweet) -> list[discord.Embed]:
         embed.set_image(url=tweet.media[0].media_url_https)
         return [embed]
     elif len(tweet.media) > 1:
+        fximage_url = None
         if configs['embed']['built_in']['fx_image']:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(re.sub(r'twitter', r'fxtwitter', tweet.url)) as response:
-                    raw = await response.text()
-            fximage_url = BeautifulSoup(raw, 'html.parser').find('meta', property='og:image')['content']
+            try:
+                fximage_url = await og_image_resolver.resolve(re.sub(r'twitter', r'fxtwitter', tweet.url))
+            except Exception as e:
+                # the combined image is only a nicety, the tweet is still delivered with one embed per image
+                log.warning(f'unable to fetch the combined image of {tweet.url}, falling back to one embed per image: {e}')
+        if fximage_url:
             embed.set_image(url=fximage_url)
             return [embed]
         else:
@@ -0,0 +1,42 @@
+import asyncio
+
+import httpx
+from tweety.exceptions import (ActionRequired, AuthenticationRequired, DeniedLogin, GuestTokenNotFound, InvalidCredentials, LockedAccount,
+                               RateLimitReached, SuspendedAccount, TwitterError)
+
+RATE_LIMIT = 'rate_limit'
+AUTH_EXPIRED = 'auth_expired'
+TRANSIENT = 'transient'
+PERMANENT = 'permanent'
+
+# Twitter API error codes and HTTP status codes of every category, used for errors raised as a plain TwitterError
+RATE_LIMIT_CODES = {88, 429, 477}
+AUTH_EXPIRED_CODES = {32, 89, 215, 220, 239, 401, 403}
+TRANSIENT_CODES = {0, 130, 131, 500, 502, 503, 504}
+
+
+def classify_error(error: BaseException) -> str:
+    """Sort an error raised by tweety into RATE_LIMIT, AUTH_EXPIRED, TRANSIENT or PERMANENT by its type and status code."""
+    if isinstance(error, RateLimitReached):
+        return RATE_LIMIT
+    if isinstance(error, (SuspendedAccount, LockedAccount, ActionRequired, DeniedLogin)):
+        return PERMANENT
+    if isinstance(error, (InvalidCredentials, AuthenticationRequired)):
+        return AUTH_EXPIRED
+    if isinstance(error, GuestTokenNotFound):
+        return TRANSIENT
+    if isinstance(error, TwitterError):
+        try:
+            code = int(error.error_code)
+        except (TypeError, ValueError):
+            return PERMANENT
+        if code in RATE_LIMIT_CODES:
+            return RATE_LIMIT
+        if code in AUTH_EXPIRED_CODES:
+            return AUTH_EXPIRED
+        if code in TRANSIENT_CODES:
+            return TRANSIENT
+        return PERMANENT
+    if isinstance(error, (httpx.TransportError, asyncio.TimeoutError, ConnectionError)):
+        return TRANSIENT
+    return PERMANENT
@@ -1,22 +1,29 @@
-import os
 from typing import Optional
 
-from src.db_function.readonly_db import connect_readonly
 from tweety.types import Tweet
 
-from src.notification.date_comparator import date_comparator
+from src.notification.cursor_store import cursor_store
+from src.notification.snowflake import tweet_id
 
 
 async def get_tweets(tweets: list[Tweet], username: str) -> Optional[list[Tweet]]:
+    """`tweets` must be ordered by tweet ID, so the new ones are found by walking back from the newest until the high-water mark."""
 
-    async with connect_readonly(os.path.join(os.getenv('DATA_PATH'), 'tracked_accounts.db')) as db:
-        async with db.execute('SELECT lastest_tweet FROM user WHERE username = ?', (username,)) as cursor:
-            row = await cursor.fetchone()
-            last_tweet_at = row[0]
+    last_tweet_id = await cursor_store.get(username)
+    if last_tweet_id is None:
+        return None
 
-    tweets = [tweet for tweet in tweets if tweet.author.username == username and date_comparator(tweet.created_on, last_tweet_at) == 1]
+    lastest_tweets, seen = [], set()
+    for tweet in reversed(tweets):
+        current_id = tweet_id(tweet)
+        if current_id <= last_tweet_id:
+            break
+        if tweet.author.username == username and current_id not in seen and not cursor_store.is_recent(username, current_id):
+            seen.add(current_id)
+            lastest_tweets.append(tweet)
 
-    if tweets != []:
-        return sorted(tweets, key=lambda x: x.created_on)
+    if lastest_tweets != []:
+        lastest_tweets.reverse()
+        return lastest_tweets
     else:
         return None
@@ -0,0 +1,69 @@
+from collections import Counter
+from datetime import datetime, timezone, timedelta
+
+from configs.load_configs import configs
+from src.notification.rate_limiter import rate_limiter
+from src.notification.subscription_index import subscription_index
+from src.utils import get_accounts
+
+
+class LoadBalancer:
+    """
+    Spreads the tracked users over the `TWITTER_TOKEN` accounts.
+
+    The load of a client is its number of enabled users, weighted up by `rate_limit_penalty`
+    for every consecutive rate limit and for a rate limit within the last `rate_limit_penalty_window` hours.
+    """
+
+    def __init__(self):
+        self.penalty = configs.get('rate_limit_penalty', 0.5)
+        self.penalty_window = timedelta(hours=configs.get('rate_limit_penalty_window', 1))
+
+    def counts(self) -> Counter:
+        counts = Counter({client: 0 for client in get_accounts().keys()})
+        counts.update(user['client_used'] for user in subscription_index.users.values() if user['client_used'] in counts)
+        return counts
+
+    def weight(self, client: str) -> float:
+        info = rate_limiter.rate_limit_info.get(client)
+        if info is None:
+            return 1
+        recent_errors = info['consecutive_errors']
+        if info['last_error_time'] is not None and datetime.now(timezone.utc) - info['last_error_time'] < self.penalty_window:
+            recent_errors += 1
+        return 1 + self.penalty * recent_errors
+
+    def score(self, client: str, count: int) -> float:
+        # + 1 so that an idle client which keeps hitting rate limits still looks busier than a healthy one
+        return (count + 1) * self.weight(client)
+
+    def pick(self) -> str:
+        """The least-loaded client, used for every new user that does not ask for a specific one."""
+        counts = self.counts()
+        return min(counts, key=lambda client: self.score(client, counts[client]))
+
+    def plan_rebalance(self) -> list[tuple[str, str, str, str]]:
+        """Moves (user_id, username, old client, new client) that even out the load, at most one user at a time between two clients."""
+        counts = self.counts()
+        users_by_client: dict[str, list[dict]] = {client: [] for client in counts}
+        for user in subscription_index.users.values():
+            if user['client_used'] in users_by_client:
+                users_by_client[user['client_used']].append(user)
+
+        moves = []
+        while True:
+            source = max(counts, key=lambda client: self.score(client, counts[client]))
+            target = min(counts, key=lambda client: self.score(client, counts[client]))
+            # only move when it lowers the busiest load without making the target busier than the source was
+            if source == target or not users_by_client[source] or self.score(target, counts[target] + 1) >= self.score(source, counts[source]):
+                break
+
+            user = users_by_client[source].pop()
+            moves.append((user['id'], user['username'], source, target))
+            counts[source] -= 1
+            counts[target] += 1
+
+        return moves
+
+
+load_balancer = LoadBalancer()
@@ -0,0 +1,53 @@
+import re
+
+import discord
+
+from configs.load_configs import configs
+from src.notification.utils import replace_emoji
+
+EMOJI_PATTERN = re.compile(r":(\w+):")
+
+
+class MessageTemplates:
+    """
+    Notification message templates with their `:emoji:` tokens already resolved.
+
+    Each guild's emojis are indexed by name (rebuilt on `on_guild_emojis_update`) and every
+    `customized_msg` is compiled once per (channel, user), so a send only has to fill in the fields.
+    """
+
+    def __init__(self):
+        self.emojis: dict[int, dict[str, str]] = {}  # guild_id -> {emoji name: emoji}
+        self.versions: dict[int, int] = {}  # guild_id -> bumped on every emoji update
+        self.templates: dict[tuple[str, str], tuple[str, int, str]] = {}  # (channel_id, user_id) -> (customized_msg, version, template)
+
+    def guild_emojis(self, guild: discord.Guild) -> dict[str, str]:
+        if guild.id not in self.emojis:
+            emojis = {}
+            for emoji in guild.emojis:
+                # the first emoji with a given name wins, like discord.utils.get
+                emojis.setdefault(emoji.name, str(emoji))
+            self.emojis[guild.id] = emojis
+        return self.emojis[guild.id]
+
+    def refresh_guild(self, guild: discord.Guild):
+        self.emojis.pop(guild.id, None)
+        self.versions[guild.id] = self.versions.get(guild.id, 0) + 1
+
+    def get(self, channel: discord.abc.GuildChannel, data: dict) -> str:
+        customized_msg = data['customized_msg']
+        if not customized_msg:
+            return configs['default_message']
+        if not configs['emoji_auto_format']:
+            return customized_msg
+
+        key, version = (data['channel_id'], data['user_id']), self.versions.get(channel.guild.id, 0)
+        cached = self.templates.get(key)
+        if cached is None or cached[0] != customized_msg or cached[1] != version:
+            emojis = self.guild_emojis(channel.guild)
+            cached = (customized_msg, version, EMOJI_PATTERN.sub(lambda match: replace_emoji(match, emojis), customized_msg))
+            self.templates[key] = cached
+        return cached[2]
+
+
+message_templates = MessageTemplates()
@@ -0,0 +1,100 @@
+import asyncio
+import codecs
+import time
+from html.parser import HTMLParser
+from typing import Optional
+
+import aiohttp
+
+from configs.load_configs import configs
+from src.log import setup_logger
+
+log = setup_logger(__name__)
+
+CHUNK_SIZE = 4096
+
+
+class OgImageParser(HTMLParser):
+    """Incremental parser that only looks for `<meta property="og:image">` and reports when the `<head>` is over."""
+
+    def __init__(self):
+        super().__init__()
+        self.og_image: Optional[str] = None
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'meta':
+            attrs = dict(attrs)
+            if attrs.get('property') == 'og:image' and attrs.get('content'):
+                self.og_image = attrs['content']
+                self.done = True
+        elif tag == 'body':
+            self.done = True
+
+    def handle_endtag(self, tag):
+        if tag == 'head':
+            self.done = True
+
+
+class OgImageResolver:
+    """
+    Resolves the `og:image` of a page through one pooled HTTP session shared by the notification path.
+
+    The page is streamed and parsing stops as soon as the tag is found or `<head>` ends, and results are
+    kept for `og_image_cache_ttl` seconds so a tweet sent to many channels is only fetched once.
+    """
+
+    def __init__(self):
+        self.ttl = configs.get('og_image_cache_ttl', 600)
+        self.cache: dict[str, tuple[float, Optional[str]]] = {}  # url -> (expires_at, og:image)
+        self.inflight: dict[str, asyncio.Future] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30, connect=10))
+        return self._session
+
+    async def resolve(self, url: str) -> Optional[str]:
+        now = time.monotonic()
+        cached = self.cache.get(url)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        # concurrent lookups of the same url share one request
+        if url in self.inflight:
+            return await asyncio.shield(self.inflight[url])
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[url] = future
+        try:
+            og_image = await self.fetch(url)
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved in case nobody else is waiting
+            raise
+        else:
+            future.set_result(og_image)
+            self.cache = {key: value for key, value in self.cache.items() if value[0] > now}
+            self.cache[url] = (now + self.ttl, og_image)
+            return og_image
+        finally:
+            del self.inflight[url]
+
+    async def fetch(self, url: str) -> Optional[str]:
+        parser = OgImageParser()
+        async with self.session().get(url) as response:
+            decoder = codecs.getincrementaldecoder(response.charset or 'utf-8')(errors='ignore')
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                parser.feed(decoder.decode(chunk))
+                if parser.done:
+                    break
+        return parser.og_image
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+og_image_resolver = OgImageResolver()
@@ -0,0 +1,45 @@
+import random
+
+from configs.load_configs import configs
+
+
+class PollScheduler:
+    """
+    Adaptive polling interval of each tweets updater.
+
+    The interval is halved after a fetch that returned new tweets and grows by `tweets_check_backoff`
+    after a quiet one, always staying between `tweets_check_period_min` and `tweets_check_period_max`.
+    A random jitter and a staggered first fetch keep the clients from polling X at the same instant.
+    """
+
+    def __init__(self):
+        base = configs['tweets_check_period']
+        self.base = base
+        self.min_period = configs.get('tweets_check_period_min', max(1, base / 2))
+        self.max_period = max(self.min_period, configs.get('tweets_check_period_max', base * 4))
+        self.backoff = configs.get('tweets_check_backoff', 1.25)
+        self.jitter = configs.get('tweets_check_jitter', 0.1)
+        self.intervals: dict[str, float] = {}  # client -> current interval without jitter
+        self.newest_ids: dict[str, int] = {}  # client -> newest tweet ID seen by the last fetch
+
+    def start_delay(self, client: str, clients: list[str]) -> float:
+        """Offset of the first fetch of `client`, spreading all the clients evenly over one base period."""
+        return self.base * clients.index(client) / len(clients) if client in clients else 0
+
+    def next_delay(self, client: str, newest_id: int) -> float:
+        interval = self.intervals.get(client, self.base)
+        if newest_id > self.newest_ids.get(client, newest_id):
+            interval = interval / 2
+        else:
+            interval = interval * self.backoff
+        interval = min(self.max_period, max(self.min_period, interval))
+
+        self.intervals[client] = interval
+        self.newest_ids[client] = max(newest_id, self.newest_ids.get(client, newest_id))
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def get_interval(self, client: str) -> float:
+        return self.intervals.get(client, self.base)
+
+
+poll_scheduler = PollScheduler()
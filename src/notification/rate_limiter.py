@@ -1,10 +1,20 @@
+import asyncio
+import json
+import os
+import time
 from datetime import datetime, timezone, timedelta
-from typing import Dict
+from typing import Dict, Optional
 
+from configs.load_configs import configs
 from src.log import setup_logger
+from src.notification.error_classifier import RATE_LIMIT, classify_error
 
 log = setup_logger(__name__)
 
+RATE_LIMIT_WINDOW = 15 * 60  # Twitter 速率限制視窗（秒）
+NOTIFICATIONS_ENDPOINT = 'get_tweet_notifications'  # tweety 以 http 方法名稱記錄各端點的速率限制
+TIMELINE_ENDPOINT = 'get_tweets'  # failover 時讀取使用者時間軸的端點
+
 class RateLimiter:
     """
     Twitter API 速率限制管理器
@@ -13,16 +23,147 @@ class RateLimiter:
     def __init__(self):
         self.rate_limit_info: Dict[str, Dict] = {}
         self.backoff_delays = [15, 30, 60, 120, 300]  # 指數退避延遲（分鐘）
+        self.buckets: Dict[str, Dict] = {}  # 每個帳戶的令牌桶
+        self.budget: Optional[int] = configs.get('rate_limit_budget')  # 未取得回應標頭前，每個視窗的預設請求數
+        self.checkpoint_interval = configs.get('rate_limit_checkpoint_interval', 60)  # 狀態寫入磁碟的間隔（秒）
+        self.dirty = False
+        self.failovers: set = set()  # 退避中、其使用者暫時由其他帳戶服務的帳戶
+        self.saved_at: Optional[datetime] = None
+    
+    @staticmethod
+    def state_path() -> str:
+        return os.path.join(os.getenv('DATA_PATH'), 'rate_limits.json')
+    
+    def load(self):
+        """從 DATA_PATH 載入上次保存的速率限制與退避狀態，讓重啟後仍遵守尚未結束的懲罰期"""
+        try:
+            with open(self.state_path(), 'r', encoding='utf8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            log.warning(f'failed to load rate limit state, starting fresh: {e}')
+            return
+        
+        for account, info in state.get('rate_limit_info', {}).items():
+            info['last_error_time'] = datetime.fromisoformat(info['last_error_time']) if info['last_error_time'] else None
+            self.rate_limit_info[account] = info
+        self.buckets.update(state.get('buckets', {}))
+        self.saved_at = datetime.fromisoformat(state['saved_at']) if state.get('saved_at') else None
+        log.info(f'rate limit state of {len(self.rate_limit_info)} accounts restored')
+    
+    def save(self):
+        """以原子方式將目前狀態寫入 DATA_PATH"""
+        saved_at = datetime.now(timezone.utc)
+        state = {
+            'saved_at': saved_at.isoformat(),
+            'rate_limit_info': {
+                account: {**info, 'last_error_time': info['last_error_time'].isoformat() if info['last_error_time'] else None}
+                for account, info in self.rate_limit_info.items()
+            },
+            'buckets': self.buckets
+        }
+        path = self.state_path()
+        with open(f'{path}.tmp', 'w', encoding='utf8') as f:
+            json.dump(state, f)
+        os.replace(f'{path}.tmp', path)
+        self.dirty, self.saved_at = False, saved_at
+    
+    async def run(self):
+        """定期保存有變更的狀態"""
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            if self.dirty:
+                try:
+                    self.save()
+                except OSError as e:
+                    log.error(f'failed to save rate limit state: {e}')
+    
+    @staticmethod
+    def bucket_key(account_name: str, endpoint: str) -> str:
+        """通知端點沿用帳戶名稱作為鍵（與已保存的狀態相容），其他端點各自使用獨立的令牌桶"""
+        return account_name if endpoint == NOTIFICATIONS_ENDPOINT else f'{account_name}:{endpoint}'
+    
+    def _get_bucket(self, account_name: str) -> Dict:
+        if account_name not in self.buckets:
+            self.buckets[account_name] = {
+                'capacity': self.budget,
+                'tokens': float(self.budget) if self.budget else None,
+                'reset_at': None,
+                'updated_at': time.time()
+            }
+        return self.buckets[account_name]
+    
+    def _refill(self, bucket: Dict, now: float):
+        """補充令牌：已知重置時間時於重置後補滿，否則依設定的預算連續補充"""
+        if bucket['tokens'] is None:
+            return
+        if bucket['reset_at'] is not None:
+            if now >= bucket['reset_at']:
+                bucket['tokens'] = float(bucket['capacity'])
+                bucket['reset_at'] = None
+        elif bucket['capacity']:
+            bucket['tokens'] = min(float(bucket['capacity']), bucket['tokens'] + (now - bucket['updated_at']) * bucket['capacity'] / RATE_LIMIT_WINDOW)
+        bucket['updated_at'] = now
+    
+    def record_request(self, account_name: str, limits: Optional[Dict] = None, endpoint: str = NOTIFICATIONS_ENDPOINT):
+        """
+        記錄一次請求並以回應標頭校正令牌桶
+        
+        Args:
+            account_name: 帳戶名稱
+            limits: tweety 的 `rate_limits`（來自 x-rate-limit-remaining / x-rate-limit-reset）
+            endpoint: 請求的端點（tweety 的 http 方法名稱）
+        """
+        bucket = self._get_bucket(self.bucket_key(account_name, endpoint))
+        now = time.time()
+        self._refill(bucket, now)
+        self.dirty = True
+        if bucket['tokens'] is not None:
+            bucket['tokens'] = max(0.0, bucket['tokens'] - 1)
+        
+        limit = (limits or {}).get(endpoint)
+        if limit:
+            remaining, reset_at = limit['limit_remaining'], limit['limit_reset']
+            bucket['capacity'] = max(bucket['capacity'] or 0, remaining + 1)
+            bucket['tokens'] = float(remaining)
+            bucket['reset_at'] = reset_at if reset_at > now else None
+    
+    def has_budget(self, account_name: str, endpoint: str = NOTIFICATIONS_ENDPOINT) -> bool:
+        """檢查帳戶在該端點是否還有令牌可用（尚無資料時視為可用）"""
+        bucket = self.buckets.get(self.bucket_key(account_name, endpoint))
+        if bucket is None or bucket['tokens'] is None:
+            return True
+        self._refill(bucket, time.time())
+        return bucket['tokens'] >= 1
+    
+    def exhaust(self, account_name: str, error: Exception, endpoint: str):
+        """端點回應速率限制時清空其令牌桶直到重置，不影響帳戶本身的退避狀態"""
+        bucket = self._get_bucket(self.bucket_key(account_name, endpoint))
+        retry_after = getattr(error, 'retry_after', None) or RATE_LIMIT_WINDOW
+        bucket['tokens'], bucket['reset_at'] = 0.0, time.time() + float(retry_after)
+        bucket['capacity'] = bucket['capacity'] or 1
+        self.dirty = True
+    
+    def get_pacing_delay(self, account_name: str) -> float:
+        """獲取下一次請求前應等待的時間（秒），讓剩餘的令牌平均分配到重置之前，從而不觸發 429"""
+        bucket = self.buckets.get(account_name)
+        if bucket is None or bucket['tokens'] is None:
+            return 0
+        
+        now = time.time()
+        self._refill(bucket, now)
+        if bucket['reset_at'] is not None:
+            if bucket['tokens'] < 1:
+                return bucket['reset_at'] - now
+            return (bucket['reset_at'] - now) / bucket['tokens']
+        if bucket['tokens'] >= 1 or not bucket['capacity']:
+            return 0
+        return (1 - bucket['tokens']) * RATE_LIMIT_WINDOW / bucket['capacity']
     
     def is_rate_limited_error(self, error: Exception) -> bool:
-        """檢查錯誤是否為速率限制錯誤"""
-        error_str = str(error).lower()
-        rate_limit_keywords = [
-            'rate limit', 'too many requests', '429', 
-            'rate_limit_exceeded', 'quota exceeded',
-            'requests per', 'limit reached'
-        ]
-        return any(keyword in error_str for keyword in rate_limit_keywords)
+        """檢查錯誤是否為速率限制錯誤（依 tweety 例外類型與狀態碼判斷）"""
+        return classify_error(error) == RATE_LIMIT
     
     def get_backoff_delay(self, account_name: str) -> int:
         """獲取指定帳戶的退避延遲時間（秒）"""
@@ -33,6 +174,11 @@ class RateLimiter:
                 'total_rate_limits': 0
             }
         
+        # 已知重置時間時，只等待到重置為止
+        bucket = self.buckets.get(account_name)
+        if bucket is not None and bucket['reset_at'] is not None and bucket['reset_at'] > time.time():
+            return int(bucket['reset_at'] - time.time()) + 1
+        
         info = self.rate_limit_info[account_name]
         error_count = min(info['consecutive_errors'], len(self.backoff_delays) - 1)
         delay_minutes = self.backoff_delays[error_count]
@@ -52,15 +198,19 @@ class RateLimiter:
         info['consecutive_errors'] += 1
         info['last_error_time'] = datetime.now(timezone.utc)
         info['total_rate_limits'] += 1
+        self.dirty = True
         
-        delay_minutes = self.backoff_delays[
-            min(info['consecutive_errors'] - 1, len(self.backoff_delays) - 1)
-        ]
+        # 錯誤本身帶有重置時間時，令牌桶清空直到該時間
+        retry_after = getattr(error, 'retry_after', None)
+        if retry_after:
+            bucket = self._get_bucket(account_name)
+            bucket['tokens'], bucket['reset_at'] = 0.0, time.time() + float(retry_after)
+            bucket['capacity'] = bucket['capacity'] or 1
         
         log.warning(
             f"Rate limit hit for account '{account_name}' "
             f"(consecutive: {info['consecutive_errors']}, total: {info['total_rate_limits']}). "
-            f"Will wait {delay_minutes} minutes before retry."
+            f"Will wait {self.get_backoff_delay(account_name)} seconds before retry."
         )
     
     def record_success(self, account_name: str):
@@ -68,8 +218,34 @@ class RateLimiter:
         if account_name in self.rate_limit_info:
             if self.rate_limit_info[account_name]['consecutive_errors'] > 0:
                 log.info(f"Account '{account_name}' recovered from rate limiting")
+                self.dirty = True
             self.rate_limit_info[account_name]['consecutive_errors'] = 0
     
+    def get_remaining_backoff(self, account_name: str) -> float:
+        """獲取上一次速率限制後尚未結束的退避時間（秒），例如重啟前進入的懲罰期"""
+        info = self.rate_limit_info.get(account_name)
+        if info is None or info['consecutive_errors'] == 0 or info['last_error_time'] is None:
+            return 0
+        
+        # 已知重置時間時以其為準，否則依退避階梯計算
+        bucket = self.buckets.get(account_name)
+        if bucket is not None and bucket['reset_at'] is not None:
+            return max(0, bucket['reset_at'] - time.time())
+        error_count = min(info['consecutive_errors'], len(self.backoff_delays) - 1)
+        elapsed = (datetime.now(timezone.utc) - info['last_error_time']).total_seconds()
+        return max(0, self.backoff_delays[error_count] * 60 - elapsed)
+    
+    def is_in_backoff(self, account_name: str) -> bool:
+        """檢查帳戶是否正處於退避期（其 tweets updater 暫時不會請求）"""
+        return self.get_remaining_backoff(account_name) > 0 or self.should_skip_request(account_name)
+    
+    async def acquire(self, account_name: str):
+        """等待帳戶結束退避期後再送出請求，供追蹤以外的請求（/sync、重新平衡）共用同一套退避狀態"""
+        while self.is_in_backoff(account_name):
+            delay = self.get_remaining_backoff(account_name) or RATE_LIMIT_WINDOW
+            log.warning(f"Account '{account_name}' is in rate limit backoff, waiting {delay:.0f} seconds before the next request")
+            await asyncio.sleep(delay)
+    
     def should_skip_request(self, account_name: str, max_wait_hours: int = 6) -> bool:
         """
         檢查是否應該跳過請求（當連續錯誤過多時）
@@ -97,21 +273,40 @@ class RateLimiter:
     
     def get_status_summary(self) -> str:
         """獲取所有帳戶的速率限制狀態摘要"""
-        if not self.rate_limit_info:
+        if not self.rate_limit_info and not self.buckets:
             return "No rate limit data available"
         
         summary = []
-        for account, info in self.rate_limit_info.items():
+        # 其他端點的令牌桶（鍵為「帳戶:端點」）列在所屬帳戶下方，而不是當成另一個帳戶
+        accounts = {key.split(':', 1)[0]: None for key in {**self.rate_limit_info, **self.buckets}}
+        for account in accounts:
+            info = self.rate_limit_info.get(account, {'consecutive_errors': 0, 'last_error_time': None, 'total_rate_limits': 0})
             if info['consecutive_errors'] > 0:
                 last_error = info['last_error_time'].strftime('%H:%M:%S') if info['last_error_time'] else 'Unknown'
                 summary.append(
                     f"  {account}: {info['consecutive_errors']} consecutive errors, "
-                    f"last at {last_error}, total: {info['total_rate_limits']}"
+                    f"last at {last_error}, total: {info['total_rate_limits']}, "
+                    f"backoff left: {int(self.get_remaining_backoff(account))}s"
                 )
             else:
                 summary.append(f"  {account}: OK (total rate limits: {info['total_rate_limits']})")
+            
+            bucket = self.buckets.get(account)
+            if bucket is not None and bucket['tokens'] is not None:
+                reset_at = datetime.fromtimestamp(bucket['reset_at'], timezone.utc).strftime('%H:%M:%S') if bucket['reset_at'] else '-'
+                summary.append(f"    tokens: {int(bucket['tokens'])}/{bucket['capacity']}, reset at {reset_at}")
+            
+            for key, bucket in self.buckets.items():
+                if key.startswith(f'{account}:') and bucket['tokens'] is not None:
+                    endpoint = key.split(':', 1)[1]
+                    reset_at = datetime.fromtimestamp(bucket['reset_at'], timezone.utc).strftime('%H:%M:%S') if bucket['reset_at'] else '-'
+                    summary.append(f"    {endpoint} tokens: {int(bucket['tokens'])}/{bucket['capacity']}, reset at {reset_at}")
+        
+        for account in sorted(self.failovers):
+            summary.append(f"  {account}: in failover, its users are served by healthy accounts")
         
-        return "Rate limit status:\n" + "\n".join(summary)
+        saved_at = self.saved_at.strftime('%Y-%m-%d %H:%M:%S') if self.saved_at else 'never'
+        return "Rate limit status:\n" + "\n".join(summary) + f"\nLast checkpoint: {saved_at}"
 
 # 全域速率限制管理器實例
 rate_limiter = RateLimiter()
@@ -0,0 +1,20 @@
+from datetime import datetime, timezone
+
+from tweety.types import Tweet
+
+TWITTER_EPOCH_MS = 1288834974657
+SEQUENCE_BITS = 22
+
+
+def snowflake_from_datetime(date: datetime) -> int:
+    """Return the largest tweet ID that can belong to the second of `date`, so only later tweets compare greater."""
+    ms = int(date.timestamp()) * 1000 + 999
+    return ((ms - TWITTER_EPOCH_MS) << SEQUENCE_BITS) | ((1 << SEQUENCE_BITS) - 1)
+
+
+def current_snowflake() -> int:
+    return snowflake_from_datetime(datetime.now(timezone.utc))
+
+
+def tweet_id(tweet: Tweet) -> int:
+    return int(tweet.id)
@@ -0,0 +1,71 @@
+from typing import Optional
+
+from src.db_function.database import database
+from src.log import setup_logger
+
+log = setup_logger(__name__)
+
+NOTIFICATION_COLUMNS = 'user_id, channel_id, role_id, enable_type, enable_media_type, customized_msg'
+
+
+class SubscriptionIndex:
+    """
+    In-memory index of the enabled users and their enabled notification rows.
+
+    It is loaded once from `tracked_accounts.db` and kept in sync through `refresh_user`,
+    which every command that mutates `user` or `notification` calls after committing.
+    """
+
+    def __init__(self):
+        self.users: dict[str, dict] = {}  # user_id -> {'id', 'username', 'client_used'}
+        self.user_ids: dict[str, str] = {}  # username -> user_id
+        self.notifications: dict[str, list[dict]] = {}  # user_id -> enabled notification rows
+        self.loaded = False
+
+    async def load(self):
+        users, user_ids, notifications = {}, {}, {}
+        async with database.reader() as db:
+            async with db.execute('SELECT id, username, client_used FROM user WHERE enabled = 1') as cursor:
+                async for row in cursor:
+                    users[row['id']] = dict(row)
+                    user_ids[row['username']] = row['id']
+            async with db.execute(f'SELECT {NOTIFICATION_COLUMNS} FROM notification WHERE enabled = 1') as cursor:
+                async for row in cursor:
+                    if row['user_id'] in users:
+                        notifications.setdefault(row['user_id'], []).append(dict(row))
+
+        self.users, self.user_ids, self.notifications = users, user_ids, notifications
+        self.loaded = True
+        log.info(f'subscription index loaded with {len(users)} users and {sum(len(rows) for rows in notifications.values())} notifications')
+
+    async def refresh_user(self, user_id: str):
+        """Write-through hook: re-read one user's row and notifications after the database has been changed."""
+        if not self.loaded:
+            return
+
+        async with database.reader() as db:
+            async with db.execute('SELECT id, username, client_used FROM user WHERE id = ? AND enabled = 1', (user_id,)) as cursor:
+                user = await cursor.fetchone()
+            async with db.execute(f'SELECT {NOTIFICATION_COLUMNS} FROM notification WHERE user_id = ? AND enabled = 1', (user_id,)) as cursor:
+                notifications = [dict(row) async for row in cursor]
+
+        old_user = self.users.pop(user_id, None)
+        if old_user is not None:
+            self.user_ids.pop(old_user['username'], None)
+        self.notifications.pop(user_id, None)
+
+        if user is not None:
+            self.users[user_id] = dict(user)
+            self.user_ids[user['username']] = user_id
+            if notifications:
+                self.notifications[user_id] = notifications
+
+    def get_user(self, username: str) -> Optional[dict]:
+        user_id = self.user_ids.get(username)
+        return self.users.get(user_id) if user_id is not None else None
+
+    def get_notifications(self, user_id: str) -> list[dict]:
+        return self.notifications.get(user_id, [])
+
+
+subscription_index = SubscriptionIndex()
@@ -0,0 +1,89 @@
+import asyncio
+import time
+from typing import Callable, Coroutine
+
+from configs.load_configs import configs
+from src.log import setup_logger
+
+log = setup_logger(__name__)
+
+# a worker that ran at least this long before dying is considered healthy again and restarts without backoff
+STABLE_RUNTIME = 600
+
+
+class TaskSupervisor:
+    """
+    Keeps long-running workers alive through direct task handles.
+
+    Every worker is started from a factory, and a done callback restarts it as soon as it crashes or returns,
+    waiting `task_restart_delay` seconds doubled on every consecutive crash, up to `task_restart_max_delay`.
+    A worker cancelled from outside the supervisor is dropped instead of restarted.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.restart_delay = configs.get('task_restart_delay', 5)
+        self.restart_max_delay = configs.get('task_restart_max_delay', 300)
+        self.tasks: dict[str, asyncio.Task] = {}
+        self.factories: dict[str, Callable[[], Coroutine]] = {}
+        self.started_at: dict[str, float] = {}
+        self.crashes: dict[str, int] = {}
+        self.restarts: dict[str, asyncio.TimerHandle] = {}
+
+    def start(self, name: str, factory: Callable[[], Coroutine]):
+        """Start (or replace) the worker `name`, which is restarted from `factory` whenever it stops."""
+        self.stop(name)
+        self.factories[name] = factory
+        self.crashes[name] = 0
+        self._spawn(name)
+
+    def stop(self, name: str):
+        self.factories.pop(name, None)
+        self.crashes.pop(name, None)
+        self.started_at.pop(name, None)
+        restart = self.restarts.pop(name, None)
+        if restart is not None:
+            restart.cancel()
+        task = self.tasks.pop(name, None)
+        if task is not None:
+            task.cancel()
+
+    def stop_all(self):
+        for name in list(self.factories):
+            self.stop(name)
+
+    def is_alive(self, name: str) -> bool:
+        task = self.tasks.get(name)
+        return task is not None and not task.done()
+
+    def _spawn(self, name: str):
+        self.restarts.pop(name, None)
+        if name not in self.factories:
+            return
+        task = self.loop.create_task(self.factories[name]())
+        task.set_name(name)
+        task.add_done_callback(self._on_done)
+        self.tasks[name] = task
+        self.started_at[name] = time.monotonic()
+
+    def _on_done(self, task: asyncio.Task):
+        name = task.get_name()
+        # stopped on purpose, or already replaced by a newer task
+        if self.tasks.get(name) is not task or name not in self.factories:
+            return
+
+        if task.cancelled():
+            # cancelled from outside, e.g. on shutdown, so it is not restarted
+            self.stop(name)
+            return
+        if task.exception() is not None:
+            log.error(f'task {name} crashed: {task.exception()!r}')
+        else:
+            log.warning(f'task {name} returned unexpectedly')
+
+        if time.monotonic() - self.started_at.get(name, 0) >= STABLE_RUNTIME:
+            self.crashes[name] = 0
+        delay = min(self.restart_delay * 2 ** self.crashes[name], self.restart_max_delay)
+        self.crashes[name] += 1
+        log.info(f'restarting {name} in {delay} seconds')
+        self.restarts[name] = self.loop.call_later(delay, self._spawn, name)
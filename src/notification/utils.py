@@ -1,5 +1,4 @@
 import re
-import discord
 
 from tweety.types import Tweet
 
@@ -13,7 +12,5 @@ def is_match_media_type(tweet: Tweet, media_type: str):
     return media_type == '11' or (media_type == '10' and len(tweet.media) == 0) or (media_type == '01' and len(tweet.media) > 0)
 
 
-def replace_emoji(match: re.Match, guild: discord.Guild):
-    emoji_name = match.group(1)
-    emoji = discord.utils.get(guild.emojis, name=emoji_name)
-    return str(emoji) if emoji else match.group(0)
+def replace_emoji(match: re.Match, emojis: dict[str, str]):
+    return emojis.get(match.group(1), match.group(0))
@@ -1,25 +1,163 @@
 import asyncio
+from collections import defaultdict
+from typing import Awaitable, Callable, Optional
 
 from tweety import Twitter
 
+from configs.load_configs import configs
 from src.log import setup_logger
+from src.db_function.database import database
+from src.notification.client_pool import client_pool
+from src.notification.error_classifier import RATE_LIMIT, classify_error
+from src.notification.load_balancer import load_balancer
+from src.notification.rate_limiter import rate_limiter
+from src.notification.subscription_index import subscription_index
 from src.utils import get_accounts
 
 log = setup_logger(__name__)
 
+SYNC_INTERVAL = configs.get('sync_interval', 1)
 
-async def sync_db(follow_list: dict[str, str]) -> None:
 
-    apps: dict[str, Twitter] = {}
-    for account_name, _ in get_accounts().items():
-        app = Twitter(account_name)
-        await app.connect()
-        apps[account_name] = app
+async def connect_apps() -> dict[str, Twitter]:
+    # the clients are shared with the tracker, so only accounts it has not authenticated yet log in here
+    return {account_name: await client_pool.get(account_name) for account_name in get_accounts().keys()}
 
+
+class SyncJob:
+    """Progress of one background `/sync` run."""
+
+    def __init__(self, total: int):
+        self.total = total
+        self.done = 0
+        self.skipped = 0
+        self.failed = 0
+        self.finished = False
+
+    def summary(self) -> str:
+        state = 'synchronization completed' if self.finished else 'synchronizing in the background'
+        return f'{state}: {self.done + self.skipped}/{self.total} users ({self.skipped} already synchronized, {self.failed} failed)'
+
+
+async def sync_db(follow_list: dict[str, str], job: Optional[SyncJob] = None) -> SyncJob:
+    """
+    Follow every user and turn on its notifications, with one queue per client running in parallel.
+
+    Users completed by an interrupted run are skipped; the caller marks `job.finished` once all of its work is done.
+    """
+
+    job = job or SyncJob(len(follow_list))
+
+    async with database.reader() as db:
+        async with db.execute('SELECT user_id, client_used FROM sync_progress') as cursor:
+            completed = {(row[0], row[1]) async for row in cursor}
+
+    queues: dict[str, list[str]] = defaultdict(list)
     for user_id, client_used in follow_list.items():
-        app = apps[client_used]
-        await app.follow_user(user_id)
-        await app.enable_user_notification(user_id)
+        if (user_id, client_used) in completed:
+            job.skipped += 1
+        elif client_used in get_accounts():
+            queues[client_used].append(user_id)
+        else:
+            log.warning(f'user {user_id} uses the unknown client {client_used}, skipped')
+            job.failed += 1
+
+    await asyncio.gather(*(sync_client(client_used, user_ids, job) for client_used, user_ids in queues.items()))
+
+    # the checkpoint only lets an interrupted run resume, a run that got to the end starts over next time
+    async with database.writer() as db:
+        await db.execute('DELETE FROM sync_progress')
+    log.info(f'synchronization with database completed, {job.done} synchronized, {job.skipped} skipped, {job.failed} failed')
+    return job
+
+
+async def sync_client(client_used: str, user_ids: list[str], job: SyncJob):
+    try:
+        app = await client_pool.get(client_used)
+    except Exception as e:
+        log.error(f'unable to synchronize the users of {client_used}: {e}')
+        job.failed += len(user_ids)
+        return
+
+    followed = await get_followed(app, len(user_ids))
+    for user_id in user_ids:
+        while True:
+            # a client penalised by the rate limiter is left alone until its backoff is over
+            await rate_limiter.acquire(client_used)
+            try:
+                if followed.get(user_id):
+                    job.skipped += 1
+                else:
+                    if user_id not in followed:
+                        await app.follow_user(user_id)
+                    await app.enable_user_notification(user_id)
+                    job.done += 1
+                    await asyncio.sleep(SYNC_INTERVAL)
+
+                async with database.writer() as db:
+                    await db.execute('INSERT OR IGNORE INTO sync_progress VALUES (?, ?)', (user_id, client_used))
+                break
+            except Exception as e:
+                if classify_error(e) != RATE_LIMIT:
+                    log.error(f'an error occurred while synchronizing {user_id} with {client_used}: {e}')
+                    job.failed += 1
+                    break
+                # recorded so the tracker and the load balancer see it too, then waited out before the next attempt
+                rate_limiter.record_rate_limit(client_used, e)
+
+
+async def get_followed(app: Twitter, count: int) -> dict[str, bool]:
+    """The users already followed by `app`, mapped to whether their notifications are on."""
+    followed = {}
+    try:
+        async for _, users in app.iter_user_followings(app.me.id, pages=count // 20 + 5):
+            for user in users:
+                followed[str(user.id)] = bool(user.notifications)
+    except Exception as e:
+        log.warning(f'unable to list the followings of {app.me.username if app.me else "unknown"}, every user will be synchronized: {e}')
+    return followed
+
+
+async def rebalance_db(on_moved: Optional[Callable[[str, str], Awaitable[None]]] = None) -> None:
+    """Move users from the busiest clients to the least-loaded ones; `on_moved(username, client_used)` runs after each move is committed."""
+
+    moves = load_balancer.plan_rebalance()
+    if not moves:
+        log.info('clients are already balanced')
+        return
+
+    apps = await connect_apps()
+
+    moved = 0
+    for user_id, username, old_client, new_client in moves:
+        try:
+            new_app, old_app = apps[new_client], apps[old_client]
+            # the client making the current call, so a rate limit is recorded against the right one
+            client = new_client
+            await rate_limiter.acquire(new_client)
+            await new_app.follow_user(user_id)
+            await new_app.enable_user_notification(user_id)
+
+            async with database.writer() as db:
+                await db.execute('UPDATE user SET client_used = ? WHERE id = ?', (new_client, user_id))
+            await subscription_index.refresh_user(user_id)
+            if on_moved is not None:
+                await on_moved(username, new_client)
+
+            client = old_client
+            if configs['auto_unfollow']:
+                await rate_limiter.acquire(old_client)
+                await old_app.unfollow_user(user_id)
+            elif configs['auto_turn_off_notification']:
+                await rate_limiter.acquire(old_client)
+                await old_app.disable_user_notification(user_id)
+
+            moved += 1
+            log.info(f'moved {username} from {old_client} to {new_client}')
+        except Exception as e:
+            log.error(f'an error occurred while moving {username} from {old_client} to {new_client}: {e}')
+            if classify_error(e) == RATE_LIMIT:
+                rate_limiter.record_rate_limit(client, e)
         await asyncio.sleep(1)
 
-    log.info('synchronization with database completed')
+    log.info(f'rebalancing completed, {moved}/{len(moves)} users moved')
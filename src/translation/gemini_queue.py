@@ -0,0 +1,106 @@
+import asyncio
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+
+from configs.load_configs import configs
+from src.log import setup_logger
+
+log = setup_logger(__name__)
+
+T = TypeVar('T')
+
+MANUAL_PRIORITY = 0  # /translate 指令，使用者正在等待
+AUTO_PRIORITY = 1  # 自動翻譯
+
+
+class TranslationQueueFull(Exception):
+    """佇列已滿，自動翻譯請求被捨棄"""
+
+
+class GeminiQueue:
+    """
+    執行阻塞 Gemini 呼叫的專用工作池
+
+    最多 `translation.workers` 個呼叫同時執行於獨立的執行緒池，其餘依優先順序排隊，手動指令優先於自動翻譯；
+    排隊中的請求達到 `translation.max_queue` 時，新的自動翻譯請求會被直接捨棄，避免通知爆量時無限堆積。
+    """
+
+    def __init__(self):
+        translation_config = configs.get('translation', {})
+        self.worker_count = max(1, translation_config.get('workers', 4))
+        self.max_queue = max(1, translation_config.get('max_queue', 20))
+        self.executor = ThreadPoolExecutor(max_workers=self.worker_count, thread_name_prefix='gemini')
+        self.stats = {'completed': 0, 'failed': 0, 'shed': 0, 'max_depth': 0}
+        self.running = 0
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers: list[asyncio.Task] = []
+        self._counter = itertools.count()  # 同優先順序依提交順序執行
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def is_full(self) -> bool:
+        """新的自動翻譯請求是否會被捨棄"""
+        return self.depth() >= self.max_queue
+
+    def _start(self):
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+        self._workers = [worker for worker in self._workers if not worker.done()]
+        for i in range(len(self._workers), self.worker_count):
+            self._workers.append(asyncio.create_task(self._work(), name=f'GeminiWorker_{i}'))
+
+    async def submit(self, func: Callable[[], T], priority: int = AUTO_PRIORITY) -> T:
+        """
+        在工作池中執行阻塞函數並等待結果
+
+        Args:
+            func: 要執行的阻塞函數
+            priority: MANUAL_PRIORITY 或 AUTO_PRIORITY，數字越小越先執行
+
+        Raises:
+            TranslationQueueFull: 佇列已滿且請求不是手動指令
+        """
+        self._start()
+        if priority != MANUAL_PRIORITY and self.is_full():
+            self.stats['shed'] += 1
+            log.warning(f"翻譯佇列已滿 ({self.depth()} 個請求排隊中)，捨棄自動翻譯請求")
+            raise TranslationQueueFull()
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((priority, next(self._counter), func, future))
+        self.stats['max_depth'] = max(self.stats['max_depth'], self.depth())
+        return await future
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, func, future = await self._queue.get()
+            # 等待者已放棄（例如指令被取消）時不再呼叫 API
+            if future.cancelled():
+                continue
+
+            self.running += 1
+            try:
+                result = await loop.run_in_executor(self.executor, func)
+            except Exception as e:
+                self.stats['failed'] += 1
+                if not future.cancelled():
+                    future.set_exception(e)
+            else:
+                self.stats['completed'] += 1
+                if not future.cancelled():
+                    future.set_result(result)
+            finally:
+                self.running -= 1
+
+    def get_status_summary(self) -> str:
+        return (
+            f"執行中：{self.running}/{self.worker_count}\n"
+            f"排隊中：{self.depth()}/{self.max_queue}（最高 {self.stats['max_depth']}）\n"
+            f"完成：{self.stats['completed']}，失敗：{self.stats['failed']}，捨棄：{self.stats['shed']}"
+        )
+
+
+gemini_queue = GeminiQueue()
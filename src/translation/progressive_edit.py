@@ -0,0 +1,44 @@
+import re
+import time
+from typing import Awaitable, Callable
+
+import discord
+
+from configs.load_configs import configs
+from src.log import setup_logger
+
+log = setup_logger(__name__)
+
+# 翻譯結果中每個段落的標題，例如 **語氣分析：**
+SECTION_HEADER_PATTERN = re.compile(r'^\*\*[^*\n]+[：:]\*\*', re.MULTILINE)
+
+
+class ProgressiveEdit:
+    """
+    將串流中的翻譯逐步更新到 Discord 訊息
+
+    只顯示已完成的段落（後面已出現下一個段落標題），並且兩次更新至少間隔 `translation.stream_edit_interval` 秒，
+    避免觸發 Discord 編輯訊息的速率限制；最終結果由呼叫者自行更新。
+    """
+
+    def __init__(self, edit: Callable[[str], Awaitable]):
+        """
+        Args:
+            edit: 以已完成段落的文字更新訊息的協程函數
+        """
+        self.edit = edit
+        self.interval = configs.get('translation', {}).get('stream_edit_interval', 1.5)
+        self.shown = 0
+        self.edited_at = 0.0
+
+    async def __call__(self, translated_text: str):
+        headers = [match.start() for match in SECTION_HEADER_PATTERN.finditer(translated_text)]
+        completed = translated_text[:headers[-1]].strip() if headers else ""
+        if len(completed) <= self.shown or time.monotonic() - self.edited_at < self.interval:
+            return
+
+        self.shown, self.edited_at = len(completed), time.monotonic()
+        try:
+            await self.edit(completed)
+        except discord.HTTPException as e:
+            log.warning(f"更新翻譯進度失敗: {e}")
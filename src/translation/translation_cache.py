@@ -0,0 +1,158 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+import aiosqlite
+
+from configs.load_configs import configs
+from src.log import setup_logger
+
+log = setup_logger(__name__)
+
+
+class TranslationCache:
+    """
+    兩層翻譯快取，以 (清理後的文字, 目標語言, 提示詞版本) 的雜湊為鍵
+
+    第一層是記憶體中的 LRU，第二層是 DATA_PATH 下的 SQLite 檔案，重啟後仍然有效；
+    磁碟上的翻譯超過 `translation.cache_ttl` 小時即過期，並只保留最近使用的 `translation.cache_max_entries` 筆。
+    同一段文字同時被多個頻道翻譯時只會呼叫一次 Gemini。
+    """
+
+    def __init__(self):
+        translation_config = configs.get('translation', {})
+        self.memory_size = max(1, translation_config.get('cache_memory_size', 256))
+        self.ttl = translation_config.get('cache_ttl', 168) * 3600
+        self.max_entries = max(1, translation_config.get('cache_max_entries', 10000))
+        self.memory: OrderedDict[str, str] = OrderedDict()
+        self.inflight: dict[str, asyncio.Future] = {}
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'shared': 0, 'misses': 0}
+        self._db: Optional[aiosqlite.Connection] = None
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def path() -> str:
+        return os.path.join(os.getenv('DATA_PATH'), 'translation_cache.db')
+
+    @staticmethod
+    def key(text: str, target_language: str, prompt_version: int) -> str:
+        return hashlib.sha256(f'{prompt_version}\0{target_language}\0{text}'.encode('utf8')).hexdigest()
+
+    async def db(self) -> aiosqlite.Connection:
+        if self._db is None:
+            connection = aiosqlite.connect(self.path())
+            # 連線與程序同生命週期，其工作執行緒不應阻止程序結束
+            connection.daemon = True
+            db = await connection
+            await db.execute('PRAGMA journal_mode = WAL')
+            await db.execute('CREATE TABLE IF NOT EXISTS translation (key TEXT PRIMARY KEY, translated_text TEXT, created_at REAL, accessed_at REAL)')
+            await db.execute('CREATE INDEX IF NOT EXISTS translation_accessed_at ON translation (accessed_at)')
+            await db.commit()
+            self._db = db
+        return self._db
+
+    def _remember(self, key: str, translated_text: str):
+        self.memory[key] = translated_text
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[str]:
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.stats['memory_hits'] += 1
+            return self.memory[key]
+
+        now = time.time()
+        try:
+            async with self._lock:
+                db = await self.db()
+                async with db.execute('SELECT translated_text FROM translation WHERE key = ? AND created_at > ?', (key, now - self.ttl)) as cursor:
+                    row = await cursor.fetchone()
+                if row is not None:
+                    await db.execute('UPDATE translation SET accessed_at = ? WHERE key = ?', (now, key))
+                    await db.commit()
+        except Exception as e:
+            log.warning(f"讀取翻譯快取失敗: {e}")
+            row = None
+
+        if row is None:
+            return None
+        self.stats['disk_hits'] += 1
+        self._remember(key, row[0])
+        return row[0]
+
+    async def put(self, key: str, translated_text: str):
+        self._remember(key, translated_text)
+        now = time.time()
+        try:
+            async with self._lock:
+                db = await self.db()
+                await db.execute('INSERT OR REPLACE INTO translation VALUES (?, ?, ?, ?)', (key, translated_text, now, now))
+                await db.execute('DELETE FROM translation WHERE created_at <= ?', (now - self.ttl,))
+                await db.execute('DELETE FROM translation WHERE key IN (SELECT key FROM translation ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+                await db.commit()
+        except Exception as e:
+            log.warning(f"寫入翻譯快取失敗: {e}")
+
+    async def get_or_create(self, key: str, factory: Callable[[], Awaitable[Optional[str]]]) -> Optional[str]:
+        """
+        從快取取得翻譯，沒有時以 `factory` 產生並寫入快取
+
+        Args:
+            key: `key()` 產生的快取鍵
+            factory: 產生翻譯的協程函數，返回 None 表示失敗，失敗的結果不會被快取
+        """
+        cached = await self.get(key)
+        if cached is not None:
+            return cached
+
+        # 等待磁碟期間可能已有其他請求完成翻譯
+        if key in self.memory:
+            self.stats['memory_hits'] += 1
+            return self.memory[key]
+        # 同一段文字的並行請求共用一次翻譯
+        if key in self.inflight:
+            self.stats['shared'] += 1
+            return await asyncio.shield(self.inflight[key])
+
+        self.stats['misses'] += 1
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            translated_text = await factory()
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 沒有其他等待者時避免未取得例外的警告
+            raise
+        else:
+            future.set_result(translated_text)
+            if translated_text is not None:
+                await self.put(key, translated_text)
+            return translated_text
+        finally:
+            del self.inflight[key]
+
+    def get_status_summary(self) -> str:
+        lookups = sum(self.stats.values())
+        hits = lookups - self.stats['misses']
+        hit_rate = f"{hits / lookups:.0%}" if lookups else "-"
+        return (
+            f"記憶體命中：{self.stats['memory_hits']}\n"
+            f"磁碟命中：{self.stats['disk_hits']}\n"
+            f"共用進行中的翻譯：{self.stats['shared']}\n"
+            f"未命中：{self.stats['misses']}\n"
+            f"命中率：{hit_rate}（記憶體中 {len(self.memory)}/{self.memory_size} 筆）"
+        )
+
+    async def close(self):
+        async with self._lock:
+            if self._db is not None:
+                await self._db.close()
+                self._db = None
+
+
+translation_cache = TranslationCache()
@@ -1,18 +1,28 @@
 import aiohttp
 import asyncio
+import os
 import re
+import time
 from bs4 import BeautifulSoup
-from typing import Optional
+from functools import partial
+from typing import Awaitable, Callable, Optional
 try:
     from google import genai
     from google.genai import types
 except ImportError:
     genai = None
     types = None
+from configs.load_configs import configs
 from src.log import setup_logger
+from src.translation.gemini_queue import AUTO_PRIORITY, TranslationQueueFull, gemini_queue
+from src.translation.translation_cache import translation_cache
 
 log = setup_logger(__name__)
 
+PROMPT_VERSION = 1  # 修改翻譯提示詞時遞增，讓舊提示詞產生的快取失效
+BATCH_MARKER = '=== 第 {} 則 ==='  # 批次翻譯中分隔每則推文與其翻譯的標記
+BATCH_MARKER_PATTERN = re.compile(r'^\W*=+\s*第\s*(\d+)\s*則\s*=+\W*$', re.MULTILINE)
+
 
 class TweetTranslator:
     def __init__(self, gemini_api_key: str):
@@ -25,8 +35,18 @@ class TweetTranslator:
         if genai is None:
             raise ImportError("google-genai 套件未安裝，請執行: pip install google-genai")
         
-        # 使用新的 Google Gen AI SDK
+        # 使用新的 Google Gen AI SDK，客戶端與其連線池在整個程序中共用
         self.client = genai.Client(api_key=gemini_api_key)
+        self._session: Optional[aiohttp.ClientSession] = None
+        
+        # 批次模式：batch_window 秒內到達的自動翻譯合併為一次請求，0 表示停用
+        translation_config = configs.get('translation', {})
+        self.batch_window = translation_config.get('batch_window', 0)
+        self.batch_size = max(1, translation_config.get('batch_size', 5))
+        self.batch_max_chars = translation_config.get('batch_max_chars', 2000)
+        self._batch: list = []  # (文字, 目標語言, future)
+        self._batch_timer: Optional[asyncio.TimerHandle] = None
+        self._batch_tasks: set = set()
         
         # 按順序嘗試可用的模型，從最新開始
         self.model_name = self._select_best_model()
@@ -44,6 +64,20 @@ class TweetTranslator:
         
         # 使用用戶指定的 gemini-2.5-pro 模型
         return model_candidates[0]
+    
+    def session(self) -> aiohttp.ClientSession:
+        """爬取推文用的共用 HTTP session，保持連線以免每則訊息都重新建立 TLS 連線"""
+        if self._session is None or self._session.closed:
+            # 使用簡短的 headers 避免 "Header value is too long" 錯誤
+            self._session = aiohttp.ClientSession(
+                headers={'User-Agent': 'Mozilla/5.0 (compatible; bot/1.0)'},
+                timeout=aiohttp.ClientTimeout(total=30, connect=10)  # 設置連線超時和讀取超時
+            )
+        return self._session
+    
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
         
     def extract_username_from_url(self, tweet_url: str) -> Optional[str]:
         """
@@ -83,39 +117,28 @@ class TweetTranslator:
             發文者的推文文字內容（不包含引用、回覆等），如果失敗則返回 None
         """
         try:
-            # 使用簡短的 headers 避免 "Header value is too long" 錯誤
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (compatible; bot/1.0)'
-            }
+            # 使用 fxtwitter 來獲取更清潔的內容
+            fx_url = tweet_url.replace('twitter.com', 'fxtwitter.com').replace('x.com', 'fxtwitter.com')
             
-            # 設置連線超時和讀取超時
-            timeout = aiohttp.ClientTimeout(total=30, connect=10)
+            try:
+                async with self.session().get(fx_url) as response:
+                    if response.status == 200:
+                        html = await response.text()
+                        content = self._extract_clean_content(html, method='fxtwitter')
+                        if content:
+                            log.info(f"成功從 fxtwitter 獲取內容: {content[:50]}...")
+                            return content
+                    else:
+                        log.warning(f"fxtwitter 返回狀態碼: {response.status}")
+            except Exception as e:
+                log.warning(f"fxtwitter 請求失敗: {e}")
             
-            async with aiohttp.ClientSession(headers=headers, timeout=timeout) as session:
-                # 使用 fxtwitter 來獲取更清潔的內容
-                fx_url = tweet_url.replace('twitter.com', 'fxtwitter.com').replace('x.com', 'fxtwitter.com')
-                
-                try:
-                    async with session.get(fx_url) as response:
-                        if response.status == 200:
-                            html = await response.text()
-                            content = self._extract_clean_content(html, method='fxtwitter')
-                            if content:
-                                log.info(f"成功從 fxtwitter 獲取內容: {content[:50]}...")
-                                return content
-                        else:
-                            log.warning(f"fxtwitter 返回狀態碼: {response.status}")
-                except Exception as e:
-                    log.warning(f"fxtwitter 請求失敗: {e}")
-                
-                # 如果失敗，返回 None
-                return None
+            # 如果失敗，返回 None
+            return None
                         
         except Exception as e:
             log.error(f"爬取推文內容失敗: {e}")
             return None
-        
-        return None
     
     def _extract_clean_content(self, html: str, method: str = 'fxtwitter') -> Optional[str]:
         """
@@ -263,7 +286,8 @@ class TweetTranslator:
         
         return content
     
-    async def translate_text(self, text: str, target_language: str = "繁體中文", platform: str = None, username: str = None) -> Optional[str]:
+    async def translate_text(self, text: str, target_language: str = "繁體中文", platform: str = None, username: str = None, priority: int = AUTO_PRIORITY,
+                             on_progress: Optional[Callable[[str], Awaitable]] = None) -> Optional[str]:
         """
         使用新的 Google Gen AI SDK 翻譯文字 - 專門針對社群媒體內容優化
         
@@ -272,16 +296,43 @@ class TweetTranslator:
         target_language: 目標語言
         platform: 平台名稱（可選，僅用於手動指令）
         username: 發文者用戶名（可選，僅用於手動指令）
+        priority: 在 Gemini 工作池中的優先順序，手動指令應使用 MANUAL_PRIORITY
+        on_progress: 串流翻譯時以目前累積的翻譯呼叫的協程函數（可選，快取命中或批次翻譯時不會呼叫）
             
         Returns:
             翻譯結果，如果失敗則返回 None
+            
+        Raises:
+            TranslationQueueFull: 工作池佇列已滿，自動翻譯請求被捨棄
         """
-        try:
-            prompt = f"""將以下社群媒體內容翻譯成{target_language}：
-
-原文：
-{text}
-請按照以下格式輸出：
+        # 批次模式下，自動翻譯與同一時間窗內的其他推文合併請求
+        if self.batch_window > 0 and priority == AUTO_PRIORITY:
+            factory = partial(self._translate_batched, text, target_language)
+        elif on_progress is not None:
+            factory = partial(self._request_stream, self._build_prompt(text, target_language), priority, on_progress)
+        else:
+            factory = partial(self._generate_translation, text, target_language, priority)
+        
+        key = translation_cache.key(text, target_language, PROMPT_VERSION)
+        translated_text = await translation_cache.get_or_create(key, factory)
+        
+        # 只有在手動指令且提供來源資訊時才添加前綴，快取中只保存翻譯本身
+        if translated_text and (platform or username):
+            source_info = ""
+            if username and platform:
+                source_info = f"來自 {username}'s {platform}\n\n"
+            elif username:
+                source_info = f"來自 {username}\n\n"
+            elif platform:
+                source_info = f"來自 {platform}\n\n"
+            translated_text = f"{source_info}{translated_text}"
+        
+        return translated_text
+    
+    @staticmethod
+    def _format_instructions(target_language: str) -> str:
+        """翻譯結果的輸出格式與翻譯要求，單則與批次翻譯共用"""
+        return f"""請按照以下格式輸出：
 
 **語氣分析：**
 [簡短描述原文的語氣、情感特色]
@@ -307,73 +358,142 @@ class TweetTranslator:
 - 提供自然流暢的台灣口語化翻譯
 - 解釋泰文語氣詞和俚語的含義
 - 注意X推文有Keyword和Hashtag的使用，保留原有格式，但不用解釋"""
+    
+    def _build_prompt(self, text: str, target_language: str) -> str:
+        return f"""將以下社群媒體內容翻譯成{target_language}：
 
-            # 使用新的 SDK 生成內容 - 調整為適合 gemini-2.5-pro 的配置
-            if types:
-                response = await asyncio.get_event_loop().run_in_executor(
-                    None,
-                    lambda: self.client.models.generate_content(
-                        model=self.model_name,
-                        contents=prompt,
-                        config=types.GenerateContentConfig(
-                            temperature=0.5,
-                            max_output_tokens=16384,  # 增加輸出 token 限制以支援格式化輸出
-                            top_p=0.95,
-                            top_k=40,
-                            safety_settings=[
-                                types.SafetySetting(
-                                    category='HARM_CATEGORY_HARASSMENT',
-                                    threshold='BLOCK_NONE',
-                                ),
-                                types.SafetySetting(
-                                    category='HARM_CATEGORY_HATE_SPEECH',
-                                    threshold='BLOCK_NONE',
-                                ),
-                                types.SafetySetting(
-                                    category='HARM_CATEGORY_SEXUALLY_EXPLICIT',
-                                    threshold='BLOCK_NONE',
-                                ),
-                                types.SafetySetting(
-                                    category='HARM_CATEGORY_DANGEROUS_CONTENT',
-                                    threshold='BLOCK_NONE',
-                                ),
-                            ]
-                        )
-                    )
-                )
+原文：
+{text}
+""" + self._format_instructions(target_language)
+    
+    def _build_batch_prompt(self, texts: list, target_language: str) -> str:
+        items = "".join(f"{BATCH_MARKER.format(i)}\n原文：\n{text}\n\n" for i, text in enumerate(texts, 1))
+        return (
+            f"將以下 {len(texts)} 則社群媒體內容分別翻譯成{target_language}：\n\n{items}"
+            f"每則翻譯都以單獨一行、與原文相同編號的「{BATCH_MARKER.format('N')}」開頭，不可省略任何一則，每則"
+        ) + self._format_instructions(target_language)
+    
+    async def _generate_translation(self, text: str, target_language: str, priority: int) -> Optional[str]:
+        """呼叫 Gemini 翻譯文字，不經過快取"""
+        return await self._request(self._build_prompt(text, target_language), priority)
+    
+    async def _translate_batched(self, text: str, target_language: str) -> Optional[str]:
+        """加入目前的批次並等待其翻譯結果"""
+        future = asyncio.get_running_loop().create_future()
+        self._batch.append((text, target_language, future))
+        if len(self._batch) >= self.batch_size:
+            self._flush_batch()
+        elif self._batch_timer is None:
+            self._batch_timer = asyncio.get_running_loop().call_later(self.batch_window, self._flush_batch)
+        return await future
+    
+    def _flush_batch(self):
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+        batch, self._batch = self._batch, []
+        
+        groups = {}
+        for item in batch:
+            groups.setdefault(item[1], []).append(item)
+        for target_language, items in groups.items():
+            task = asyncio.create_task(self._run_batch(items, target_language))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+    
+    async def _run_batch(self, items: list, target_language: str):
+        try:
+            results = await self._generate_batch_translation([text for text, _, _ in items], target_language)
+        except Exception as e:
+            results = [e] * len(items)
+        
+        for (_, _, future), result in zip(items, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
             else:
-                # 備用方案：如果 types 未導入，使用字典配置
-                response = await asyncio.get_event_loop().run_in_executor(
-                    None,
-                    lambda: self.client.models.generate_content(
-                        model=self.model_name,
-                        contents=prompt,
-                        config={
-                            'temperature': 0.3,
-                            'max_output_tokens': 8192,  # 增加輸出 token 限制
-                            'top_p': 0.95,
-                            'top_k': 40,
-                        }
-                    )
-                )
+                future.set_result(result)
+    
+    async def _generate_batch_translation(self, texts: list, target_language: str) -> list:
+        """
+        以一次請求翻譯多則文字，並將回應拆回每則的翻譯
+        
+        只有一則、或合計過長時改為逐則翻譯；回應中缺少的項目也會逐則重新翻譯。
+        
+        Returns:
+            與 texts 順序相同的翻譯結果，失敗的項目為 None
+        """
+        if len(texts) == 1 or sum(len(text) for text in texts) > self.batch_max_chars:
+            return await asyncio.gather(*(self._generate_translation(text, target_language, AUTO_PRIORITY) for text in texts), return_exceptions=True)
+        
+        log.info(f"批次翻譯 {len(texts)} 則推文")
+        response_text = await self._request(self._build_batch_prompt(texts, target_language), AUTO_PRIORITY)
+        parts = BATCH_MARKER_PATTERN.split(response_text or "")
+        translations = {int(number): translation.strip() for number, translation in zip(parts[1::2], parts[2::2])}
+        
+        results = [translations.get(i) or None for i in range(1, len(texts) + 1)]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            log.warning(f"批次翻譯回應缺少 {len(missing)} 則，改為逐則翻譯")
+            retried = await asyncio.gather(*(self._generate_translation(texts[i], target_language, AUTO_PRIORITY) for i in missing), return_exceptions=True)
+            for i, result in zip(missing, retried):
+                results[i] = result
+        return results
+    
+    @staticmethod
+    def _generation_config():
+        """生成設定，單次請求與串流請求共用"""
+        # 使用新的 SDK 生成內容 - 調整為適合 gemini-2.5-pro 的配置
+        if types:
+            return types.GenerateContentConfig(
+                temperature=0.5,
+                max_output_tokens=16384,  # 增加輸出 token 限制以支援格式化輸出
+                top_p=0.95,
+                top_k=40,
+                safety_settings=[
+                    types.SafetySetting(
+                        category='HARM_CATEGORY_HARASSMENT',
+                        threshold='BLOCK_NONE',
+                    ),
+                    types.SafetySetting(
+                        category='HARM_CATEGORY_HATE_SPEECH',
+                        threshold='BLOCK_NONE',
+                    ),
+                    types.SafetySetting(
+                        category='HARM_CATEGORY_SEXUALLY_EXPLICIT',
+                        threshold='BLOCK_NONE',
+                    ),
+                    types.SafetySetting(
+                        category='HARM_CATEGORY_DANGEROUS_CONTENT',
+                        threshold='BLOCK_NONE',
+                    ),
+                ]
+            )
+        # 備用方案：如果 types 未導入，使用字典配置
+        return {
+            'temperature': 0.3,
+            'max_output_tokens': 8192,  # 增加輸出 token 限制
+            'top_p': 0.95,
+            'top_k': 40,
+        }
+    
+    async def _request(self, prompt: str, priority: int) -> Optional[str]:
+        """在 Gemini 工作池中送出提示詞並取出回應文字，失敗時返回 None"""
+        try:
+            response = await gemini_queue.submit(
+                lambda: self.client.models.generate_content(
+                    model=self.model_name,
+                    contents=prompt,
+                    config=self._generation_config()
+                ),
+                priority
+            )
             
             # 處理回應
             # 檢查各種可能的回應格式
             if hasattr(response, 'text') and response.text:
                 translated_text = response.text.strip()
-
-                # 只有在手動指令且提供來源資訊時才添加前綴
-                if platform or username:
-                    source_info = ""
-                    if username and platform:
-                        source_info = f"來自 {username}'s {platform}\n\n"
-                    elif username:
-                        source_info = f"來自 {username}\n\n"
-                    elif platform:
-                        source_info = f"來自 {platform}\n\n"
-                    
-                    if source_info:
-                        translated_text = f"{source_info}{translated_text}"
                 
                 if translated_text and len(translated_text.strip()) > 0:
                     log.info(f"翻譯成功: {translated_text[:100]}...")
@@ -395,19 +515,6 @@ class TweetTranslator:
                         if hasattr(part, 'text') and part.text:
                             translated_text = part.text.strip()
 
-                            # 只有在手動指令且提供來源資訊時才添加前綴
-                            if platform or username:
-                                source_info = ""
-                                if username and platform:
-                                    source_info = f"來自 {username}'s {platform}\n\n"
-                                elif username:
-                                    source_info = f"來自 {username}\n\n"
-                                elif platform:
-                                    source_info = f"來自 {platform}\n\n"
-                                
-                                if source_info:
-                                    translated_text = f"{source_info}{translated_text}"
-
                             if translated_text:
                                 log.info(f"翻譯成功: {translated_text[:100]}...")
                                 return translated_text
@@ -415,17 +522,74 @@ class TweetTranslator:
             log.warning("無法從 API 回應中提取翻譯內容")
             return None
             
+        except TranslationQueueFull:
+            raise
         except Exception as e:
             log.error(f"新 SDK 翻譯失敗: {e}")
             return None
     
-    async def translate_tweet(self, tweet_url: str, target_language: str = "繁體中文", tracked_users: list = None) -> dict:
+    async def _request_stream(self, prompt: str, priority: int, on_progress: Callable[[str], Awaitable]) -> Optional[str]:
+        """
+        以串流方式送出提示詞，每收到一段回應就以目前累積的文字呼叫 `on_progress`
+        
+        Returns:
+            完整的回應文字，失敗時返回 None
+        """
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        
+        def stream():
+            last_chunk = None
+            for chunk in self.client.models.generate_content_stream(model=self.model_name, contents=prompt, config=self._generation_config()):
+                if chunk.text:
+                    # 串流在工作池的執行緒中讀取，片段交回事件迴圈處理
+                    loop.call_soon_threadsafe(chunks.put_nowait, chunk.text)
+                last_chunk = chunk
+            return last_chunk
+        
+        request = asyncio.ensure_future(gemini_queue.submit(stream, priority))
+        translated_text = ""
+        try:
+            while True:
+                chunk = asyncio.ensure_future(chunks.get())
+                await asyncio.wait({chunk, request}, return_when=asyncio.FIRST_COMPLETED)
+                if not chunk.done():
+                    chunk.cancel()
+                    break
+                translated_text += chunk.result()
+                await on_progress(translated_text)
+            
+            # 請求結束前已送出但尚未處理的片段
+            while not chunks.empty():
+                translated_text += chunks.get_nowait()
+            last_chunk = request.result()
+        except TranslationQueueFull:
+            raise
+        except Exception as e:
+            log.error(f"串流翻譯失敗: {e}")
+            return None
+        finally:
+            request.cancel()
+        
+        if last_chunk is not None and last_chunk.candidates and str(last_chunk.candidates[0].finish_reason) == 'MAX_TOKENS':
+            log.error("回應被截斷 (MAX_TOKENS)，翻譯失敗")
+            return None
+        if not translated_text.strip():
+            log.warning("無法從 API 回應中提取翻譯內容")
+            return None
+        log.info(f"串流翻譯成功: {translated_text[:100]}...")
+        return translated_text.strip()
+    
+    async def translate_tweet(self, tweet_url: str, target_language: str = "繁體中文", tracked_users: list = None, priority: int = AUTO_PRIORITY,
+                              on_progress: Optional[Callable[[str], Awaitable]] = None) -> dict:
         """
         完整的推文翻譯流程 - 只翻譯發文者的原始內容
         
         Args:
             tweet_url: 推文網址
             target_language: 目標語言
+            priority: 在 Gemini 工作池中的優先順序，手動指令應使用 MANUAL_PRIORITY
+            on_progress: 串流翻譯時以目前累積的翻譯呼叫的協程函數（可選）
             
         Returns:
             包含原文、翻譯和發文者資訊的字典
@@ -436,7 +600,8 @@ class TweetTranslator:
             "cleaned_text": None,  # 新增：顯示清理後的文字
             "translated_text": None,
             "username": None,  # 新增：發文者用戶名
-            "error": None
+            "error": None,
+            "skipped": False  # 佇列已滿而被略過的自動翻譯，不是錯誤
         }
         
         try:
@@ -470,7 +635,7 @@ class TweetTranslator:
             
             # 步驟4: 翻譯內容
             log.info(f"開始翻譯成{target_language}")
-            translated_text = await self.translate_text(cleaned_content, target_language)
+            translated_text = await self.translate_text(cleaned_content, target_language, priority=priority, on_progress=on_progress)
             
             if not translated_text:
                 result["error"] = "❌ 翻譯失敗\n\n可能原因：\n• Gemini API 配額用盡\n• API 金鑰無效\n• 網路連線問題\n• 內容包含不支援的格式\n\n💡 建議：\n• 檢查 API 金鑰是否有效\n• 稍後再試\n• 聯繫管理員檢查配置"
@@ -480,6 +645,9 @@ class TweetTranslator:
             result["success"] = True
             log.info(f"翻譯完成: {translated_text[:50]}...")
             
+        except TranslationQueueFull:
+            result["error"] = "❌ 目前翻譯請求過多，已略過此推文，請稍後再試"
+            result["skipped"] = True
         except Exception as e:
             result["error"] = f"處理過程中發生錯誤: {str(e)}"
             log.error(f"翻譯推文時發生錯誤: {e}")
@@ -530,3 +698,44 @@ class TweetTranslator:
             return ""
         
         return content.strip()
+
+
+_translator: Optional[TweetTranslator] = None
+_init_failed_at: Optional[float] = None  # 上次初始化失敗的時間，失敗後只在 `translation.init_retry_delay` 秒後重試
+
+
+def get_translator() -> Optional[TweetTranslator]:
+    """
+    獲取整個程序共用的翻譯器，首次呼叫時建立
+    
+    初始化失敗只記錄一次日誌，之後每隔 `translation.init_retry_delay` 秒才會重試
+    
+    Returns:
+        共用的翻譯器，未設定 GEMINI_API_KEY 或初始化失敗時返回 None
+    """
+    global _translator, _init_failed_at
+    if _translator is not None:
+        return _translator
+    
+    retry_delay = configs.get('translation', {}).get('init_retry_delay', 300)
+    if _init_failed_at is not None and time.monotonic() - _init_failed_at < retry_delay:
+        return None
+    
+    gemini_api_key = os.getenv('GEMINI_API_KEY')
+    if not gemini_api_key:
+        if _init_failed_at is None:
+            log.warning("未設定 GEMINI_API_KEY 環境變數，翻譯功能將無法使用")
+        _init_failed_at = time.monotonic()
+        return None
+    try:
+        _translator = TweetTranslator(gemini_api_key=gemini_api_key)
+    except Exception as e:
+        if _init_failed_at is None:
+            log.error(f"Gemini API 翻譯器初始化失敗: {e}")
+        _init_failed_at = time.monotonic()
+        return None
+    
+    if _init_failed_at is not None:
+        log.info("Gemini API 翻譯器初始化成功")
+        _init_failed_at = None
+    return _translator
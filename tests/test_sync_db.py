@@ -0,0 +1,68 @@
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+
+# configs.yml is read from the working directory when the modules are imported
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp()
+with open(os.path.join(WORKDIR, 'configs.yml'), 'w', encoding='utf8') as f:
+    f.write('sync_interval: 0\nauto_unfollow: false\nauto_turn_off_notification: false\n')
+os.chdir(WORKDIR)
+os.environ['DATA_PATH'] = WORKDIR
+os.environ['TWITTER_TOKEN'] = 'a:1'
+sys.path.insert(0, ROOT)
+
+from src.db_function.database import database
+from src.db_function.init_db import init_db
+from src.sync_db import sync_db as sync_module
+
+
+class FakeApp:
+    me = None
+
+    def __init__(self, failing: set[str]):
+        self.failing = failing
+        self.followed: list[str] = []
+
+    async def iter_user_followings(self, *args, **kwargs):
+        return
+        yield
+
+    async def follow_user(self, user_id: str):
+        if user_id in self.failing:
+            raise ValueError('user suspended')
+        self.followed.append(user_id)
+
+    async def enable_user_notification(self, user_id: str):
+        pass
+
+
+class SyncCheckpointTest(unittest.TestCase):
+    def test_permanent_failure_does_not_keep_the_checkpoint(self):
+        follow_list = {'1': 'a', '2': 'a', '3': 'a'}
+
+        async def run(app: FakeApp) -> sync_module.SyncJob:
+            async def get(account_name: str) -> FakeApp:
+                return app
+
+            sync_module.client_pool.get = get
+            return await sync_module.sync_db(follow_list)
+
+        async def main():
+            await init_db()
+            first = await run(FakeApp(failing={'2'}))
+            self.assertEqual((first.done, first.failed), (2, 1))
+
+            app = FakeApp(failing=set())
+            second = await run(app)
+            self.assertEqual(app.followed, ['1', '2', '3'])
+            self.assertEqual((second.done, second.skipped, second.failed), (3, 0, 0))
+            await database.close()
+
+        asyncio.run(main())
+
+
+if __name__ == '__main__':
+    unittest.main()